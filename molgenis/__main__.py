@@ -0,0 +1,5 @@
+import sys
+
+from molgenis.cli import main
+
+sys.exit(main())
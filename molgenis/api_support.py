@@ -1,6 +1,9 @@
+import threading
+import time
 from enum import Enum
 from dataclasses import dataclass, field
 from http.cookiejar import CookiePolicy
+from typing import Callable, Optional
 
 
 class BlockAll(CookiePolicy):
@@ -36,6 +39,87 @@ class Headers:
             object.__setattr__(self, "ct_token_header", {})
 
 
+@dataclass(frozen=True)
+class Progress:
+    """
+    Progress of a long-running operation, passed to the progress callback of the operation. The entity is the entity
+    type the operation works on, or the file name for uploads. The total is None when it is not known (yet).
+    """
+
+    operation: str
+    entity: str
+    done: int
+    total: Optional[int]
+    elapsed: float
+    unit: str = "rows"
+
+    @property
+    def rate(self) -> float:
+        """The number of units (rows or bytes) per second so far"""
+        return self.done / self.elapsed if self.elapsed else 0.0
+
+
+class ProgressTracker:
+    """
+    Counts the progress of an operation, possibly in multiple threads, and reports it to a progress callback. Reports
+    are sent at most every min_interval seconds, except for the final one.
+    """
+
+    def __init__(self,
+                 callback: Callable[[Progress], None],
+                 operation: str,
+                 entity: str,
+                 total: int = None,
+                 unit: str = "rows",
+                 min_interval: float = 0.1):
+        self.total = total
+        self._callback = callback
+        self._operation = operation
+        self._entity = entity
+        self._unit = unit
+        self._min_interval = min_interval
+        self._done = 0
+        self._reported = None
+        self._start = time.monotonic()
+        self._last_report = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def of(cls, callback: Optional[Callable[[Progress], None]], operation: str, entity: str, total: int = None,
+           unit: str = "rows") -> Optional["ProgressTracker"]:
+        """Returns a ProgressTracker, or None when there is no callback so that tracking costs nothing"""
+        return cls(callback, operation, entity, total, unit) if callback else None
+
+    @property
+    def done(self) -> int:
+        """The number of rows or bytes that are done"""
+        return self._done
+
+    def advance(self, amount: int):
+        """Adds an amount of rows or bytes that are done"""
+        with self._lock:
+            self._done += amount
+            now = time.monotonic()
+            throttled = self._done != self.total and now - self._last_report < self._min_interval
+            if throttled or self._done == self._reported:
+                return
+            progress = self._progress(now)
+        self._callback(progress)
+
+    def finish(self):
+        """Reports the final progress, unless it has been reported already"""
+        with self._lock:
+            if self._reported == self._done:
+                return
+            progress = self._progress(time.monotonic())
+        self._callback(progress)
+
+    def _progress(self, now: float) -> Progress:
+        self._last_report = now
+        self._reported = self._done
+        return Progress(self._operation, self._entity, self._done, self.total, now - self._start, self._unit)
+
+
 class ImportDataAction(Enum):
     """Enum of MOLGENIS import actions"""
 
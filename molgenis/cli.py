@@ -0,0 +1,241 @@
+"""Command-line tool for bulk operations on a MOLGENIS server.
+
+Usage:
+
+    molgenis --url https://molgenis.example.org --username admin count Person
+    molgenis --url https://molgenis.example.org export Person persons.jsonl --query "age=gt=18"
+    molgenis --url https://molgenis.example.org import Person persons.csv --mode upsert
+    molgenis --url https://source.example.org copy Person --target-url https://target.example.org
+    molgenis --url https://molgenis.example.org delete Person --query "age=lt=0"
+
+The token or password can also be passed in the MOLGENIS_TOKEN and MOLGENIS_PASSWORD environment variables. Rows are
+read and written as JSON lines, or as CSV when the file name ends with .csv. Use - for stdin or stdout.
+"""
+import argparse
+import csv
+import getpass
+import json
+import os
+import sys
+import time
+from contextlib import nullcontext
+from typing import Iterable, Iterator, List
+
+import requests
+
+from molgenis.api_support import Progress, ProgressTracker
+from molgenis.client import MAX_BATCH_SIZE, Session
+from molgenis.errors import MolgenisRequestError
+
+_LIST_TYPES = {"mref", "categorical_mref", "one_to_many"}
+
+
+class _Reporter:
+    """Reports the progress of a command on stderr and prints a throughput and latency summary at the end."""
+
+    def __init__(self, action: str, entity: str, sessions: List[Session], total: int = None, live: bool = False):
+        self._action = action
+        self._sessions = sessions
+        self._live = live
+        self._start = time.monotonic()
+        self._tracker = ProgressTracker(self._report, action, entity, total, min_interval=0.5)
+
+    def advance(self, rows: int):
+        self._tracker.advance(rows)
+
+    def update(self, progress: Progress):
+        """Follows the progress reported by a Session method."""
+        self._tracker.total = progress.total
+        self._tracker.advance(progress.done - self._tracker.done)
+
+    def summary(self):
+        self._tracker.finish()
+        elapsed = time.monotonic() - self._start
+        requests = [session.request_statistics() for session in self._sessions]
+        count = sum(statistics["requests"] for statistics in requests)
+        total_latency = sum(statistics["mean_latency"] * statistics["requests"] for statistics in requests)
+        mean_latency = total_latency / count if count else 0.0
+        max_latency = max(statistics["max_latency"] for statistics in requests)
+        if self._live:
+            sys.stderr.write("\n")
+        sys.stderr.write("{} {} rows in {:.1f} s ({:.0f} rows/s), {} requests, latency mean {:.3f} s, max {:.3f} s\n"
+                         .format(self._action, self._tracker.done, elapsed,
+                                 self._tracker.done / elapsed if elapsed else 0.0, count, mean_latency, max_latency))
+
+    def _report(self, progress: Progress):
+        if self._live:
+            total = "/{}".format(progress.total) if progress.total is not None else ""
+            sys.stderr.write("\r{} {}{} rows ({:.0f} rows/s)".format(progress.operation, progress.done, total,
+                                                                    progress.rate))
+            sys.stderr.flush()
+
+
+def main(argv: List[str] = None) -> int:
+    args = _parser().parse_args(argv)
+    try:
+        session = _connect(args.url, args.token, args.username, args.password, args.concurrency)
+        return args.command(args, session)
+    except (MolgenisRequestError, requests.RequestException, ValueError) as ex:
+        sys.stderr.write("error: {}\n".format(getattr(ex, "message", ex)))
+        return 1
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="molgenis", description="Bulk operations on a MOLGENIS server.")
+    parser.add_argument("--url", default=os.getenv("MOLGENIS_URL", "http://localhost:8080/"),
+                        help="URL of the server (default: $MOLGENIS_URL or http://localhost:8080/)")
+    parser.add_argument("--token", default=os.getenv("MOLGENIS_TOKEN"), help="token (default: $MOLGENIS_TOKEN)")
+    parser.add_argument("--username", help="log in with this username instead of a token")
+    parser.add_argument("--password", default=os.getenv("MOLGENIS_PASSWORD"),
+                        help="password (default: $MOLGENIS_PASSWORD, otherwise prompted)")
+    parser.add_argument("--concurrency", type=int, default=8, help="maximum number of requests in flight")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE, help="number of rows per request")
+    parser.add_argument("--progress", action="store_true", help="show live progress on stderr")
+    commands = parser.add_subparsers(dest="command_name", metavar="command", required=True)
+
+    export = commands.add_parser("export", help="write the rows of an entity type to a file")
+    export.add_argument("entity")
+    export.add_argument("file", help="output file, .csv for CSV, otherwise JSON lines, - for stdout")
+    export.add_argument("--query", help="RSQL query selecting the rows")
+    export.set_defaults(command=_export)
+
+    import_ = commands.add_parser("import", help="add, update or upsert the rows in a file")
+    import_.add_argument("entity")
+    import_.add_argument("file", help="input file, .csv for CSV, otherwise JSON lines, - for stdin")
+    import_.add_argument("--mode", choices=["add", "update", "upsert"], default="add")
+    import_.set_defaults(command=_import)
+
+    copy = commands.add_parser("copy", help="copy the rows of an entity type to another server")
+    copy.add_argument("entity")
+    copy.add_argument("--query", help="RSQL query selecting the rows")
+    copy.add_argument("--target-url", required=True)
+    copy.add_argument("--target-entity", help="entity type on the target server (default: the same)")
+    copy.add_argument("--target-token", default=os.getenv("MOLGENIS_TARGET_TOKEN"))
+    copy.add_argument("--target-username")
+    copy.add_argument("--target-password", default=os.getenv("MOLGENIS_TARGET_PASSWORD"))
+    copy.add_argument("--mode", choices=["add", "update", "upsert"], default="add")
+    copy.set_defaults(command=_copy)
+
+    delete = commands.add_parser("delete", help="delete rows of an entity type")
+    delete.add_argument("entity")
+    selection = delete.add_mutually_exclusive_group(required=True)
+    selection.add_argument("--query", help="RSQL query selecting the rows to delete")
+    selection.add_argument("--all", action="store_true", help="delete all rows")
+    delete.set_defaults(command=_delete)
+
+    count = commands.add_parser("count", help="print the number of rows of an entity type")
+    count.add_argument("entity")
+    count.add_argument("--query", help="RSQL query selecting the rows")
+    count.set_defaults(command=_count)
+    return parser
+
+
+def _connect(url: str, token: str, username: str, password: str, concurrency: int) -> Session:
+    if username:
+        session = Session(url, max_concurrency=concurrency)
+        session.login(username, password or getpass.getpass("Password for {}: ".format(username)))
+        return session
+    return Session(url, token=token, max_concurrency=concurrency)
+
+
+def _export(args, session: Session) -> int:
+    reporter = _Reporter("Exported", args.entity, [session], session.count(args.entity, args.query), args.progress)
+    with _open(args.file, "w", sys.stdout) as file:
+        write = _row_writer(file, args.file, session.get_meta(args.entity, abstract=True))
+        for rows in session.iter_pages(args.entity, q=args.query, batch_size=args.batch_size, uploadable=True):
+            write(rows)
+            reporter.advance(len(rows))
+    reporter.summary()
+    return 0
+
+
+def _import(args, session: Session) -> int:
+    reporter = _Reporter("Imported", args.entity, [session], live=args.progress)
+    with _open(args.file, "r", sys.stdin) as file:
+        rows = _row_reader(file, args.file, session.get_meta(args.entity, abstract=True))
+        _write_rows(session, args.entity, args.mode, args.batch_size, rows, reporter)
+    reporter.summary()
+    return 0
+
+
+def _copy(args, session: Session) -> int:
+    target = _connect(args.target_url, args.target_token, args.target_username, args.target_password,
+                      args.concurrency)
+    reporter = _Reporter("Copied", args.entity, [session, target], session.count(args.entity, args.query),
+                         args.progress)
+    pages = session.iter_pages(args.entity, q=args.query, batch_size=args.batch_size, uploadable=True)
+    _write_rows(target, args.target_entity or args.entity, args.mode, args.batch_size,
+                (row for rows in pages for row in rows), reporter)
+    reporter.summary()
+    return 0
+
+
+def _delete(args, session: Session) -> int:
+    if args.all:
+        reporter = _Reporter("Deleted", args.entity, [session], live=args.progress)
+        total = session.count(args.entity)
+        session.delete(args.entity)
+        reporter.advance(total)
+    else:
+        reporter = _Reporter("Deleted", args.entity, [session], live=args.progress)
+        session.delete_where(args.entity, args.query, progress=reporter.update)
+    reporter.summary()
+    return 0
+
+
+def _count(args, session: Session) -> int:
+    print(session.count(args.entity, args.query))
+    return 0
+
+
+def _write_rows(session: Session, entity: str, mode: str, batch_size: int, rows: Iterable[dict],
+                reporter: _Reporter):
+    with session.writer(entity, mode=mode, batch_size=batch_size, flush_interval=None) as writer:
+        for batch in _batches(rows, batch_size):
+            writer.write_all(batch)
+            reporter.advance(len(batch))
+
+
+def _batches(rows: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _open(path: str, mode: str, standard_stream):
+    if path == "-":
+        return nullcontext(standard_stream)
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def _row_writer(file, path: str, meta: dict):
+    if not path.endswith(".csv"):
+        return lambda rows: file.writelines(json.dumps(row) + "\n" for row in rows)
+
+    attributes = [attr["data"]["name"] for attr in meta["attributes"]["items"]
+                  if attr["data"]["type"].lower() != "compound"]
+    writer = csv.DictWriter(file, fieldnames=attributes, extrasaction="ignore")
+    writer.writeheader()
+
+    def write(rows: List[dict]):
+        # The identifiers of referenced rows can be numbers
+        writer.writerows({name: ",".join(map(str, value)) if isinstance(value, list) else value
+                          for name, value in row.items()} for row in rows)
+    return write
+
+
+def _row_reader(file, path: str, meta: dict) -> Iterator[dict]:
+    if not path.endswith(".csv"):
+        return (json.loads(line) for line in file if line.strip())
+
+    list_attributes = {attr["data"]["name"] for attr in meta["attributes"]["items"]
+                       if attr["data"]["type"].lower() in _LIST_TYPES}
+    # Empty values are left out, references to multiple rows are comma separated
+    return ({name: value.split(",") if name in list_attributes else value for name, value in row.items() if value}
+            for row in csv.DictReader(file))
+
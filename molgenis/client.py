@@ -1,24 +1,49 @@
 
 import json
 import os
+import threading
+from collections import deque
+from concurrent.futures import (Executor, FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed,
+                                wait)
 import tempfile
+from contextlib import ExitStack
 from pathlib import Path
-from time import sleep
-from typing import List, Union, Any
-from urllib.parse import quote_plus, urlparse, parse_qs
+from time import sleep, monotonic
+from typing import List, Union, Any, Iterator, Dict, Tuple, Callable, Iterable, Optional
+from urllib.parse import quote, quote_plus
 from zipfile import ZipFile
 
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
+except ImportError:  # Files are read into memory before they are uploaded
+    MultipartEncoder = MultipartEncoderMonitor = None
 
 from molgenis.api_support import (BlockAll,
                                   Headers,
                                   ImportDataAction,
-                                  ImportMetadataAction)
+                                  ImportMetadataAction,
+                                  Progress,
+                                  ProgressTracker)
 
+from molgenis.concurrency import AdaptiveLimiter, OVERLOADED_STATUS_CODES, SingleFlight, backoff_delay
+from molgenis.converters import convert_rows, get_converters, json_default
 from molgenis.errors import MolgenisRequestError, raise_exception
+from molgenis.frames import FrameBuilder
+from molgenis.journal import Journal, content_hash, open_journal
+from molgenis.results import CompactRows, SpilledRows
+from molgenis.rsql import LocalTable
+from molgenis.writer import Writer
 import molgenis.query_utils as query_utils
 import molgenis.utils as utils
 
+MAX_BATCH_SIZE = 1000  # The maximum number of rows the REST API v2 accepts in one request
+_ENTITY_TYPE_FIELDS = "id,label,description,package,extends,isAbstract"
+_ATTRIBUTE_FIELDS = ("id,entity,sequenceNr,name,type,isIdAttribute,isLabelAttribute,lookupAttributeIndex,refEntityType,"
+                     "isNullable,isAuto,isReadOnly,isUnique,label,description,enumOptions")
+
 
 class Session:
     """Representation of a session with the MOLGENIS REST API.
@@ -27,55 +52,125 @@ class Session:
     >>> session = Session('http://localhost:8080/')
     >>> session.login('user', 'password')
     >>> session.get('Person')
+
+    A Session can be pickled and used after a fork, e.g. in the workers of a ProcessPoolExecutor. Only the URL, token,
+    configuration and metadata cache are pickled. The connection pool is created again when it is first used in
+    another process.
+
+    A Session is thread-safe: all methods can be called concurrently from multiple threads, which share its
+    connection pool, concurrency limits and caches. Every request uses the token that was current when it was sent.
+    When the Session was logged in with login and a request is rejected with 401 Unauthorized because the token has
+    expired, the Session logs in again, once for all threads that hit the expired token, and sends the request again.
+    The password is kept in memory for this, but is never pickled.
     """
 
-    def __init__(self, url: str = "http://localhost:8080/", token: str = None):
+    def __init__(self,
+                 url: str = "http://localhost:8080/",
+                 token: str = None,
+                 max_concurrency: int = 8,
+                 max_requests_per_second: float = None,
+                 max_retries: int = 3):
         """Constructs a new Session.
         Args:
         url -- URL of the REST API. Should be of form 'http[s]://<molgenis server>[:port]/'
         token -- authentication token if you are already logged in
+        max_concurrency -- the maximum number of requests in flight at the same time. The actual number is adjusted
+            to the latencies and 429/503 responses of the server.
+        max_requests_per_second -- an optional hard cap on the number of requests per second
+        max_retries -- the number of times a request is retried when the server responds it is overloaded (429/503)
 
         Examples:
         >>> session = Session('http://localhost:8080/')
+        >>> session = Session('http://localhost:8080/', max_concurrency=16, max_requests_per_second=50)
         """
         self._set_urls(url)
-        self._session = requests.Session()
-        self._session.cookies.policy = BlockAll()
-        self._token = token
-        self._headers = Headers(token=self._token)
+        self._max_concurrency = max_concurrency
+        self._max_requests_per_second = max_requests_per_second
+        self._max_retries = max_retries
+        self._http_session = None
+        self._pid = None
+        self._session_lock = threading.Lock()
+        self._login_lock = threading.Lock()
+        self._credentials = None
+        # The token is swapped atomically by replacing the (immutable) Headers, requests use the Headers they read
+        self._headers = Headers(token=token)
+        self._meta_cache = {}
+        self._ref_cache = {}
+
+    @property
+    def _token(self) -> Optional[str]:
+        return self._headers.token
+
+    def __getstate__(self) -> dict:
+        # The credentials are left out on purpose, a pickled Session can't log in again
+        return {'url': self._root_url,
+                'token': self._token,
+                'max_concurrency': self._max_concurrency,
+                'max_requests_per_second': self._max_requests_per_second,
+                'max_retries': self._max_retries,
+                'meta_cache': dict(self._meta_cache)}
+
+    def __setstate__(self, state: dict):
+        meta_cache = state.pop('meta_cache')
+        self.__init__(**state)
+        self._meta_cache.update(meta_cache)
+
+    @property
+    def _session(self) -> requests.Session:
+        """The connection pool of this Session. It is created on first use, and again in a forked process because
+        connections (and the locks of the concurrency controller) can't be shared between processes."""
+        if self._http_session is None or self._pid != os.getpid():
+            with self._session_lock:
+                if self._http_session is None or self._pid != os.getpid():
+                    session = requests.Session()
+                    session.cookies.policy = BlockAll()
+                    adapter = HTTPAdapter(pool_maxsize=self._max_concurrency)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._limiter = AdaptiveLimiter(maximum=self._max_concurrency,
+                                                    max_requests_per_second=self._max_requests_per_second)
+                    self._single_flight = SingleFlight()
+                    self._http_session = session
+                    self._pid = os.getpid()
+        return self._http_session
+
+    @property
+    def _in_flight(self) -> SingleFlight:
+        """The GET requests in flight in this process, which concurrent identical GET requests join."""
+        self._session  # Created together with the connection pool, because futures can't be shared between processes
+        return self._single_flight
+
+    def request_statistics(self) -> dict:
+        """Returns the number of requests this Session has sent (in this process) and their mean and maximum latency
+        in seconds."""
+        self._session  # Creates the concurrency controller when no request has been sent yet
+        return self._limiter.statistics()
 
     def login(self, username: str, password: str):
-        """Logs in a user and stores the acquired token in this Session object.
+        """Logs in a user and stores the acquired token in this Session object. The credentials are kept to log in
+        again when the token expires.
 
         Args:
         username -- username for a registered molgenis user
         password -- password for the user
         """
-        response = self._session.post(self._api_url + "v1/login",
-                                      data=json.dumps({"username": username,
-                                                       "password": password}),
-                                      headers={"Content-Type": "application/json"})
-        try:
-            response.raise_for_status()
-        except requests.RequestException as ex:
-            raise_exception(ex)
+        response = self._request("POST", self._api_url + "v1/login",
+                                 data=json.dumps({"username": username,
+                                                  "password": password}),
+                                 headers={"Content-Type": "application/json"})
 
-        self._token = response.json()['token']
-        self._headers = Headers(token=self._token)
+        self._credentials = (username, password)
+        self._headers = Headers(token=response.json()['token'])
 
     def logout(self):
         """Logs out the current token."""
-        response = self._session.post(self._api_url + "v1/logout",
-                                      headers=self._headers.token_header)
-        try:
-            response.raise_for_status()
-        except requests.RequestException as ex:
-            raise_exception(ex)
+        self._request("POST", self._api_url + "v1/logout", headers=self._headers.token_header)
 
-        self._token = None
+        self._credentials = None
+        self._headers = Headers(token=None)
 
     def get_by_id(self, entity: str, id_: str, attributes: str = None,
-                  expand: str = None, uploadable: bool = False) -> dict:
+                  expand: str = None, uploadable: bool = False, typed: bool = False) -> dict:
         """Retrieves a single entity row from an entity repository.
 
         Args:
@@ -84,26 +179,32 @@ class Session:
         attributes -- The list of attributes to retrieve (comma separated)
         expand -- the attributes to expand, string with commas to separate multiple attributes.
         uploadable -- when true the output of the REST Client will be changed such that it can be uploaded again
+        typed -- when true, DATE, DATE_TIME and DECIMAL values are converted to date, datetime and Decimal
 
         Examples:
         >>> session = Session('http://localhost:8080/api/')
         >>> session.get(entity='Person', id_='John', expand='name,age')
         """
-        possible_options = {'attrs': [attributes, expand]}
+        projections = None
+        if uploadable:
+            # Request only the idAttribute of referenced rows
+            projections = self._get_ref_id_attributes(entity)
+            if attributes:
+                attributes = ','.join(dict.fromkeys(query_utils.split_if_not_none(attributes) +
+                                                    query_utils.split_if_not_none(expand)))
+            expand = None
+        possible_options = {'attrs': [attributes, expand, projections]}
 
         url = query_utils.build_api_url(self._api_url + "v2/" + quote_plus(entity) + '/' + quote_plus(id_), possible_options)
-        response = self._session.get(url, headers=self._headers.token_header)
-
-        try:
-            response.raise_for_status()
-        except requests.RequestException as ex:
-            raise_exception(ex)
+        response = self._request("GET", url, headers=self._headers.token_header)
 
         result = response.json()
         response.close()
 
         if uploadable:
-            result = self.to_upload_format(entity, [result])[0]
+            result = utils.to_upload_format([result], projections)[0]
+        if typed:
+            convert_rows([result], get_converters(self._get_cached_meta(entity)))
 
         return result
 
@@ -118,7 +219,12 @@ class Session:
             sort_order: str = None,
             raw: bool = False,
             expand: str = None,
-            uploadable: bool = False) -> Union[List[dict], dict]:
+            uploadable: bool = False,
+            resolve_refs: bool = False,
+            compact: bool = False,
+            typed: bool = False,
+            spill: bool = False,
+            progress: Callable[[Progress], None] = None) -> Union[List[dict], dict, CompactRows, SpilledRows]:
         """Retrieves all entity rows from an entity repository.
 
         Args:
@@ -134,6 +240,19 @@ class Session:
         sortOrder -- the order to sort in
         raw -- when true, the complete REST response will be returned, rather than the data items alone
         uploadable -- when true the output of the REST Client will be changed such that it can be uploaded again
+        resolve_refs -- when true, the attributes in expand are not expanded by the server. Instead only the
+            identifiers of the referenced rows are retrieved and replaced by the referenced rows from a cache that
+            is shared by all calls on this Session. Resolved rows are shared between rows, so copy them before
+            changing them.
+        compact -- when true, the rows are returned as CompactRows, which stores the rows as tuples with a shared
+            attribute schema and without the _href and _meta fields, taking a lot less memory for large results
+        typed -- when true, DATE, DATE_TIME and DECIMAL values are converted to datetime.date, datetime.datetime and
+            decimal.Decimal, using converters derived once from the metadata. Values of expanded references are not
+            converted. Typed rows can be passed to add_all and update_all as they are.
+        spill -- when true, the rows are returned as SpilledRows, which stores the pages in a temporary database on
+            disk as they arrive and keeps only the most recently used pages in memory, for results that don't fit in
+            memory. Close it to remove the database file.
+        progress -- a function that is called with the Progress (in rows) while the pages are retrieved
 
         Examples:
         >>> session = Session('http://localhost:8080/api/')
@@ -142,42 +261,475 @@ class Session:
         >>> session.get(entity='Person', expand='mother,father'])
         >>> session.get(entity='Person', sort_column='age', sort_order='desc')
         >>> session.get('Person', raw=True)
+        >>> session.get(entity='Person', expand='mother,father', resolve_refs=True)
+        >>> session.get('Person', compact=True)[0]['name']
+        >>> session.get('Person', typed=True)[0]['birthDate'].year
+        >>> with session.get('Person', batch_size=10000, spill=True) as persons: print(persons[123456])
+        >>> session.get('Person', progress=lambda p: print(p.done, '/', p.total))
         """
-        if not sort_column:  # Ensure correct ordering for batched retrieval for old Molgenis instances
-            sort_column = self.get_entity_meta_data(entity)['idAttribute']
-
-        batch_start = start
-        items = []
-        while not num or len(items) < num:  # Keep pulling in batches
-            response = self._get_batch(
-                entity=entity,
-                q=q,
-                attributes=attributes,
-                batch_size=batch_size,
-                start=batch_start,
-                sort_column=sort_column,
-                sort_order=sort_order,
-                raw=True,
-                expand=expand)
+        if compact and spill:
+            raise ValueError("The compact and spill options can't be combined")
+        if spill:
+            items = SpilledRows(page_size=batch_size)
+        else:
+            items = CompactRows(self._get_attribute_names(entity, attributes)) if compact else []
+        for response in self._iter_responses(entity, q, attributes, num, batch_size, start, sort_column, sort_order,
+                                             expand, uploadable, resolve_refs, typed, progress):
             if raw:
                 return response  # Simply return the first batch response JSON
-            else:
-                items.extend(response['items'])
+            items.extend(response['items'][:num - len(items)] if num else response['items'])
+        return items
 
-            if 'nextHref' in response:  # There is more to fetch
-                decomposed_url = urlparse(response['nextHref'])
-                query_part_url = parse_qs(decomposed_url.query)
-                batch_start = query_part_url['start'][0]
-            else:
-                break  # We caught them all
+    def iter_pages(self,
+                   entity: str,
+                   q: str = None,
+                   attributes: str = None,
+                   num: int = None,
+                   batch_size: int = 100,
+                   start: int = 0,
+                   sort_column: str = None,
+                   sort_order: str = None,
+                   expand: str = None,
+                   uploadable: bool = False,
+                   resolve_refs: bool = False,
+                   typed: bool = False,
+                   progress: Callable[[Progress], None] = None) -> Iterator[List[dict]]:
+        """Retrieves entity rows page by page, yielding the rows of every page in order. The pages after the first are
+        retrieved concurrently while the rows are consumed, but never more than max_concurrency pages ahead, so that
+        large results can be processed without keeping them in memory. The arguments are the same as those of get.
 
-        if num:  # Truncate items
-            items = items[:num]
+        Examples:
+        >>> for rows in session.iter_pages('Person', batch_size=10000, uploadable=True):
+        ...     write(rows)
+        """
+        retrieved = 0
+        for response in self._iter_responses(entity, q, attributes, num, batch_size, start, sort_column, sort_order,
+                                             expand, uploadable, resolve_refs, typed, progress):
+            rows = response['items'][:num - retrieved] if num else response['items']
+            retrieved += len(rows)
+            yield rows
+
+    def _iter_responses(self, entity: str, q: Optional[str], attributes: Optional[str], num: Optional[int],
+                        batch_size: int, start: int, sort_column: Optional[str], sort_order: Optional[str],
+                        expand: Optional[str], uploadable: bool, resolve_refs: bool, typed: bool,
+                        progress: Optional[Callable[[Progress], None]]) -> Iterator[dict]:
+        """Retrieves the REST responses of the pages for get and iter_pages, with their rows converted as requested."""
+        if not sort_column:  # Ensure correct ordering for batched retrieval for old Molgenis instances
+            sort_column = utils.get_id_attribute(self._get_cached_meta(entity))
+
+        resolve_refs = resolve_refs and expand and not uploadable
+        refreshed = set()
+        projections = None
+        if resolve_refs or uploadable:
+            # Only retrieve the identifiers of the references, uploadable rows don't need more and resolved
+            # references are expanded client-side
+            if attributes:
+                attributes = ','.join(dict.fromkeys(query_utils.split_if_not_none(attributes) +
+                                                    query_utils.split_if_not_none(expand)))
+            server_expand = None
+            if uploadable:
+                projections = self._get_ref_id_attributes(entity)
+        else:
+            server_expand = expand
+
+        converters = get_converters(self._get_cached_meta(entity)) if typed else None
+        tracker = ProgressTracker.of(progress, "get", entity)
+        for response in self._iter_pages(entity=entity,
+                                         q=q,
+                                         attributes=attributes,
+                                         num=num,
+                                         batch_size=batch_size,
+                                         start=start,
+                                         sort_column=sort_column,
+                                         sort_order=sort_order,
+                                         expand=server_expand,
+                                         projections=projections):
+            if resolve_refs:
+                self._resolve_references(entity, response['items'], expand, refreshed)
+            if uploadable:
+                response['items'] = utils.to_upload_format(response['items'], projections)
+            if converters:
+                convert_rows(response['items'], converters)
+            if tracker:
+                remaining = max(0, response['total'] - start)
+                tracker.total = min(remaining, num) if num else remaining
+                tracker.advance(len(response['items']))
+            yield response
+
+        if tracker:
+            tracker.finish()
+
+    def get_frame(self,
+                  entity: str,
+                  q: str = None,
+                  attributes: str = None,
+                  num: int = None,
+                  batch_size: int = 1000,
+                  start: int = 0,
+                  sort_column: str = None,
+                  sort_order: str = None):
+        """Retrieves entity rows from an entity repository as a pandas DataFrame. The rows are converted to typed
+        columns page by page, using the attribute types from the metadata: INT and LONG become nullable integers,
+        DECIMAL floats, BOOL nullable booleans, DATE and DATE_TIME datetimes, CATEGORICAL and ENUM categories. Only
+        the identifiers of references are retrieved. Requires pandas.
 
-        if uploadable:
-            items = self.to_upload_format(entity, items)
+        Args:
+        entity -- fully qualified name of the entity
+        q -- query in rsql format
+        attributes -- The list of attributes to retrieve (as comma-separated string)
+        num -- the maximum amount of entity rows to retrieve
+        batch_size - the amount of entity rows to retrieve per time (max. 10.000)
+        start -- the index of the first row to retrieve (zero indexed)
+        sort_column -- the attribute to sort on
+        sort_order -- the order to sort in
 
-        return items
+        Examples:
+        >>> session = Session('http://localhost:8080/api/')
+        >>> session.get_frame('Person', q='age=gt=18', attributes='name,age,city')
+        """
+        meta = self._get_cached_meta(entity)
+        if not sort_column:  # Ensure correct ordering for batched retrieval for old Molgenis instances
+            sort_column = utils.get_id_attribute(meta)
+        types = {attr["data"]["name"]: attr["data"]["type"] for attr in meta["attributes"]["items"]}
+        ref_ids = self._get_ref_id_attributes(entity)
+        builder = FrameBuilder(self._get_attribute_names(entity, attributes), types, ref_ids)
+
+        retrieved = 0
+        for response in self._iter_pages(entity=entity,
+                                         q=q,
+                                         attributes=attributes,
+                                         num=num,
+                                         batch_size=batch_size,
+                                         start=start,
+                                         sort_column=sort_column,
+                                         sort_order=sort_order,
+                                         projections=ref_ids):
+            page = response['items']
+            if num:  # Truncate the last page
+                page = page[:num - retrieved]
+            retrieved += len(page)
+            builder.add_page(page)
+
+        return builder.build()
+
+    def get_local_table(self,
+                        entity: str,
+                        q: str = None,
+                        attributes: str = None,
+                        indexes: Iterable[str] = ()) -> LocalTable:
+        """Retrieves the rows of an entity type once into a LocalTable, which evaluates RSQL queries locally. Use it
+        for repeated lookups in small, slowly changing entity types.
+
+        Args:
+        entity -- fully qualified name of the entity
+        q -- query in rsql format selecting the rows to retrieve
+        attributes -- the attributes to retrieve (as comma-separated string)
+        indexes -- the attributes to index besides the idAttribute, e.g. those that are often filtered on
+
+        Examples:
+        >>> session = Session('http://localhost:8080/api/')
+        >>> cities = session.get_local_table('City', indexes=['country'])
+        >>> cities.get('country==NL;population=gt=100000')
+        """
+        meta = self._get_cached_meta(entity)
+        types = {attr["data"]["name"]: attr["data"]["type"] for attr in meta["attributes"]["items"]}
+        rows = self.get(entity, q=q, attributes=attributes, batch_size=10000, uploadable=True)
+        return LocalTable(rows, types, dict.fromkeys([utils.get_id_attribute(meta), *indexes]))
+
+    def get_many(self,
+                 queries: Dict[str, dict],
+                 max_workers: int = None,
+                 stream: bool = False) -> Union[Dict[str, List[dict]], Iterator[Tuple[str, List[dict]]]]:
+        """Retrieves the rows of multiple entity repositories concurrently.
+
+        Args:
+        queries -- maps fully qualified entity names to the keyword arguments to pass to get for that entity
+            (e.g. q, attributes, expand), or to None to retrieve all rows
+        max_workers -- the maximum number of entities that are retrieved at the same time, defaults to the maximum
+            concurrency of this Session. The requests of all entities share the concurrency limits of this Session.
+        stream -- when true, (entity, rows) tuples are yielded as soon as an entity has been retrieved, instead of
+            returning a dict with the rows of all entities
+
+        Examples:
+        >>> session = Session('http://localhost:8080/api/')
+        >>> session.get_many({'Person': {'q': 'age=gt=18'}, 'City': None})
+        >>> for entity, rows in session.get_many({'Person': None, 'City': None}, stream=True):
+        ...     print(entity, len(rows))
+        """
+        max_workers = max_workers or self._max_concurrency
+        if stream:
+            return self._get_many_as_completed(queries, max_workers)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {entity: executor.submit(self.get, entity, **(options or {}))
+                       for entity, options in queries.items()}
+            return {entity: future.result() for entity, future in futures.items()}
+
+    def map_pages(self,
+                  func: Callable[[List[dict]], Any],
+                  entity: str,
+                  executor: Executor = None,
+                  batch_size: int = 1000,
+                  q: str = None,
+                  **options) -> Iterator[Any]:
+        """Applies a function to the rows of an entity repository page by page in a process pool, yielding the
+        results in page order. Each worker retrieves its own page with a copy of this Session, so the rows aren't
+        transferred between processes and no extra logins are needed.
+
+        Args:
+        func -- a picklable function taking a list of rows, e.g. a module-level function
+        entity -- fully qualified name of the entity
+        executor -- the process pool to use, by default a ProcessPoolExecutor is created for this call
+        batch_size -- the amount of entity rows per page (max. 10.000)
+        q -- query in rsql format
+        **options -- other keyword arguments for get, e.g. attributes, expand, sort_column or uploadable
+
+        Examples:
+        >>> session = Session('http://localhost:8080/api/')
+        >>> session.login('user', 'password')
+        >>> for result in session.map_pages(summarize, 'Person', batch_size=5000, uploadable=True):
+        ...     print(result)
+        """
+        if not options.get('sort_column'):  # All workers must page through the rows in the same order
+            options['sort_column'] = utils.get_id_attribute(self._get_cached_meta(entity))
+        total = self.count(entity, q=q)
+
+        own_executor = executor is None
+        executor = executor or ProcessPoolExecutor()
+        try:
+            futures = [executor.submit(_apply_to_page, self, func, entity, start, batch_size, q, options)
+                       for start in range(0, total, batch_size)]
+            for future in futures:
+                yield future.result()
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+    def _get_many_as_completed(self, queries: Dict[str, dict], max_workers: int) -> Iterator[Tuple[str, List[dict]]]:
+        """Retrieves the rows of multiple entities concurrently, yielding them in order of completion."""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.get, entity, **(options or {})): entity
+                       for entity, options in queries.items()}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def _iter_pages(self,
+                    entity: str,
+                    q: str = None,
+                    attributes: str = None,
+                    num: int = None,
+                    batch_size: int = 100,
+                    start: int = 0,
+                    sort_column: str = None,
+                    sort_order: str = None,
+                    expand: str = None,
+                    projections: dict = None) -> Iterator[dict]:
+        """Retrieves entity rows batch by batch, yielding the complete REST response of each batch. After the first
+        batch, the remaining batches are retrieved concurrently."""
+        options = {'entity': entity,
+                   'q': q,
+                   'attributes': attributes,
+                   'batch_size': batch_size,
+                   'sort_column': sort_column,
+                   'sort_order': sort_order,
+                   'raw': True,
+                   'expand': expand,
+                   'projections': projections}
+        response = self._get_batch(start=start, **options)
+        yield response
+        if 'nextHref' not in response:  # We caught them all
+            return
+
+        end = response['total'] if not num else min(response['total'], start + num)
+        with ThreadPoolExecutor(max_workers=self._max_concurrency) as executor:
+            pending = deque()
+            for batch_start in range(start + batch_size, end, batch_size):
+                pending.append(executor.submit(self._get_batch, start=batch_start, **options))
+                if len(pending) >= self._max_concurrency:  # Don't run too far ahead of the consumer
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _get_attribute_names(self, entity: str, attributes: str = None) -> List[str]:
+        """Returns the names of the requested attributes, or of all data attributes of the entity."""
+        if attributes:
+            return query_utils.split_if_not_none(attributes)
+        return [attr["data"]["name"] for attr in self._get_cached_meta(entity)["attributes"]["items"]
+                if attr["data"]["type"].lower() != "compound"]
+
+    def _resolve_references(self, entity: str, rows: List[dict], expand: str, refreshed: set):
+        """Replaces the references of the expand attributes in rows by the referenced rows from the reference cache.
+        A reference table is retrieved again (once per set of refreshed tables) when it contains unknown identifiers.
+        """
+        meta = self._get_cached_meta(entity)
+        for attr_name in query_utils.split_if_not_none(expand):
+            ref_entity = utils.get_ref_entity_type_id(utils.get_attribute(meta, attr_name))
+            if not ref_entity:
+                continue
+            ref_id_attr = utils.get_id_attribute(self._get_cached_meta(ref_entity))
+
+            ref_ids = set()
+            for row in rows:
+                value = row.get(attr_name)
+                if type(value) is dict:
+                    ref_ids.add(value[ref_id_attr])
+                elif type(value) is list:
+                    ref_ids.update(ref[ref_id_attr] for ref in value)
+
+            ref_rows = self._get_ref_rows(ref_entity, ref_id_attr)
+            if not ref_ids.issubset(ref_rows) and ref_entity not in refreshed:
+                refreshed.add(ref_entity)
+                self._ref_cache.pop(ref_entity, None)
+                ref_rows = self._get_ref_rows(ref_entity, ref_id_attr)
+
+            for row in rows:
+                value = row.get(attr_name)
+                if type(value) is dict:
+                    row[attr_name] = ref_rows.get(value[ref_id_attr], value)
+                elif type(value) is list:
+                    row[attr_name] = [ref_rows.get(ref[ref_id_attr], ref) for ref in value]
+
+    def _get_ref_rows(self, ref_entity: str, ref_id_attr: str) -> dict:
+        """Returns all rows of a reference entity type mapped by their identifier, retrieving them only once."""
+        # Return the local value, another thread may clear the cache in the meantime
+        rows = self._ref_cache.get(ref_entity)
+        if rows is None:
+            ref_rows = self.get(ref_entity, batch_size=10000, sort_column=ref_id_attr)
+            rows = self._ref_cache[ref_entity] = {row[ref_id_attr]: row for row in ref_rows}
+        return rows
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Sends a request within the concurrency limits of this Session. Requests that the server rejects because it
+        is overloaded (429 or 503) are retried after a backoff, unless they upload files or stream their body. Requests
+        rejected because the token has expired are sent again after logging in again, see Session. Raises a
+        MolgenisRequestError when the response indicates an error.
+
+        Identical GET requests (same URL, parameters and token) that are sent concurrently share one request and
+        response. A GET request that starts after a request that changes data has completed never shares the response
+        of a GET request that started before."""
+        if method != "GET" or set(kwargs) - {'headers', 'params'}:
+            try:
+                return self._send(method, url, **kwargs)
+            finally:
+                if method != "GET":
+                    self._in_flight.forget()
+
+        key = (url,
+               tuple(sorted((kwargs.get('params') or {}).items())),
+               tuple(sorted((kwargs.get('headers') or {}).items())))
+        return self._in_flight.do(key, lambda: self._read(self._send(method, url, **kwargs)))
+
+    @staticmethod
+    def _read(response: requests.Response) -> requests.Response:
+        """Reads the body of a response, so that it can be shared by multiple callers."""
+        response.content
+        return response
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Sends a request, retrying it when the server is overloaded, and once more after logging in again when the
+        token has expired."""
+        resendable = not kwargs.get('files') and not hasattr(kwargs.get('data'), 'read')
+        response = self._send_with_retries(method, url, resendable, **kwargs)
+
+        token = (kwargs.get('headers') or {}).get('x-molgenis-token')
+        if response.status_code == 401 and token and self._credentials and resendable:
+            response.close()
+            self._login_again(token)
+            kwargs['headers'] = dict(kwargs['headers'], **self._headers.token_header)
+            response = self._send_with_retries(method, url, resendable, **kwargs)
+
+        try:
+            response.raise_for_status()
+        except requests.RequestException as ex:
+            raise_exception(ex)
+
+        return response
+
+    def _login_again(self, expired_token: str):
+        """Logs in again with the stored credentials, unless another thread has already replaced the expired
+        token."""
+        with self._login_lock:
+            credentials = self._credentials
+            if self._token == expired_token and credentials:
+                self.login(*credentials)
+
+    def _send_with_retries(self, method: str, url: str, resendable: bool, **kwargs) -> requests.Response:
+        """Sends a request within the concurrency limits, retrying it when the server is overloaded."""
+        retries = self._max_retries if resendable else 0
+        for attempt in range(retries + 1):
+            session = self._session
+            limiter = self._limiter
+            limiter.acquire()
+            start = monotonic()
+            try:
+                response = session.request(method, url, **kwargs)
+            except requests.RequestException:
+                limiter.release(monotonic() - start, overloaded=True)
+                raise
+            overloaded = response.status_code in OVERLOADED_STATUS_CODES
+            limiter.release(monotonic() - start, overloaded)
+            if not overloaded or attempt == retries:
+                break
+            response.close()
+            sleep(backoff_delay(attempt, response.headers.get('Retry-After')))
+        return response
+
+    def _map_concurrently(self, func: Callable, items: Iterable) -> list:
+        """Applies func to all items in a thread pool and returns the results in order. The number of requests in
+        flight is limited by the concurrency controller of this Session."""
+        items = list(items)
+        if len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(len(items), self._max_concurrency)) as executor:
+            return list(executor.map(func, items))
+
+    @staticmethod
+    def _journaled(journal: Optional[Journal], operation: str, entity: str, chunk: int, rows: Any,
+                   write: Callable[[], Any], start: int = None) -> Any:
+        """Writes a chunk of rows and records it in the journal, unless the journal shows it has been committed by
+        an earlier run. Returns the (recorded) result of writing the chunk."""
+        if journal is None:
+            return write()
+        # Hash the rows before writing them, writing may change them (e.g. when they are converted to CSV)
+        hash_ = content_hash(rows)
+        entry = journal.get(operation, entity, chunk, hash_)
+        if entry is not None:
+            return entry["result"]
+        result = write()
+        journal.record(operation, entity, chunk, hash_, result, start, start + len(rows) if start is not None else None)
+        return result
+
+    def _map_in_dependency_order(self, func: Callable, dependencies: dict) -> dict:
+        """Applies func to all keys of dependencies in a thread pool and returns the results mapped by key. The keys
+        map to the keys they depend on: func is only applied to a key when it has been applied to all of them. When
+        func raises an exception, no more keys are started and the exception is raised."""
+        remaining = {key: set(depends_on) & set(dependencies) - {key} for key, depends_on in dependencies.items()}
+        results = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self._max_concurrency) as executor:
+            while remaining or running:
+                for key in [key for key, depends_on in remaining.items() if depends_on <= results.keys()]:
+                    running[executor.submit(func, key)] = key
+                    del remaining[key]
+                if not running:
+                    raise ValueError("Circular dependencies between {}".format(", ".join(map(str, remaining))))
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        return results
+
+    def _get_cached_meta(self, entity_type_id: str) -> dict:
+        """Returns the metadata (including inherited attributes) of an entity type, retrieving it only once."""
+        # Return the local value, another thread may clear the cache in the meantime
+        meta = self._meta_cache.get(entity_type_id)
+        if meta is None:
+            meta = self._meta_cache[entity_type_id] = self.get_meta(entity_type_id, abstract=True)
+        return meta
+
+    def clear_cache(self):
+        """Clears the metadata and reference entity caches of this Session."""
+        self._meta_cache.clear()
+        self._ref_cache.clear()
 
     def _get_batch(self,
                    entity: str,
@@ -188,27 +740,73 @@ class Session:
                    sort_column: str = None,
                    sort_order: str = None,
                    raw: bool = False,
-                   expand: str = None) -> Union[List[dict], dict]:
+                   expand: str = None,
+                   projections: dict = None) -> Union[List[dict], dict]:
         """ Retrieves a batch of entity rows from an entity repository. """
         possible_options = {'q': q,
-                            'attrs': [attributes, expand],
+                            'attrs': [attributes, expand, projections],
                             'num': batch_size,
                             'start': start,
                             'sort': [sort_column, sort_order]}
 
         url = query_utils.build_api_url(self._api_url + "v2/" + quote_plus(entity), possible_options)
-        response = self._session.get(url, headers=self._headers.token_header)
-
-        try:
-            response.raise_for_status()
-        except requests.RequestException as ex:
-            raise_exception(ex)
+        response = self._request("GET", url, headers=self._headers.token_header)
 
         if raw:
             return response.json()
         else:
             return response.json()["items"]
 
+    def count(self, entity: str, q: str = None) -> int:
+        """Counts the entity rows in an entity repository without retrieving them.
+
+        Args:
+        entity -- fully qualified name of the entity
+        q -- query in rsql format, only rows matching the query are counted
+
+        Examples:
+        >>> session = Session('http://localhost:8080/api/')
+        >>> session.count('Person', q='age=gt=18')
+        """
+        url = query_utils.build_api_url(self._api_url + "v2/" + quote_plus(entity), {'q': q, 'num': 0})
+        response = self._request("GET", url, headers=self._headers.token_header)
+
+        return response.json()['total']
+
+    def aggregate(self, entity: str, x: str, y: str = None, distinct: str = None, q: str = None) -> dict:
+        """Counts the entity rows in an entity repository per value of one or two attributes, without retrieving them.
+
+        Args:
+        entity -- fully qualified name of the entity
+        x -- the attribute to group the rows by
+        y -- an optional second attribute to group the rows by
+        distinct -- when given, the distinct values of this attribute are counted instead of the rows
+        q -- query in rsql format, only rows matching the query are counted
+
+        Returns a dict mapping the values of x to their count, or if y is given, a dict mapping the values of x to a
+        dict mapping the values of y to their count. References are represented by their identifier.
+
+        Examples:
+        >>> session = Session('http://localhost:8080/api/')
+        >>> session.aggregate('Person', x='city')
+        {'Groningen': 10, 'Amsterdam': 5}
+        >>> session.aggregate('Person', x='city', y='gender', q='age=gt=18')
+        {'Groningen': {'female': 4, 'male': 5}, 'Amsterdam': {'female': 3, 'male': 1}}
+        """
+        aggs = ';'.join('{}=={}'.format(key, value) for key, value in
+                        (('x', x), ('y', y), ('distinct', distinct)) if value)
+        url = query_utils.build_api_url(self._api_url + "v2/" + quote_plus(entity), {'q': q, 'aggs': aggs})
+        response = self._request("GET", url, headers=self._headers.token_header)
+
+        aggs = response.json()['aggs']
+        ref_ids = self._get_ref_id_attributes(entity)
+        x_labels = [utils.aggregate_label(label, ref_ids.get(x)) for label in aggs['xLabels']]
+        if not y:
+            return {label: counts[0] for label, counts in zip(x_labels, aggs['matrix'])}
+
+        y_labels = [utils.aggregate_label(label, ref_ids.get(y)) for label in aggs['yLabels']]
+        return {x_label: dict(zip(y_labels, counts)) for x_label, counts in zip(x_labels, aggs['matrix'])}
+
     def add(self, entity: str, data: dict = None, files: dict = None, **kwargs) -> str:
         """Adds a single entity row to an entity repository.
 
@@ -235,76 +833,315 @@ class Session:
             data = {}
         if not files:
             files = {}
+        self._ref_cache.pop(entity, None)
 
-        response = self._session.post(self._api_url + "v1/" + quote_plus(entity),
-                                      headers=self._headers.token_header,
-                                      data=utils.merge_two_dicts(data, kwargs),
-                                      files=files)
-        try:
-            response.raise_for_status()
-        except requests.RequestException as ex:
-            raise_exception(ex)
+        response = self._request("POST", self._api_url + "v1/" + quote_plus(entity),
+                                 headers=self._headers.token_header,
+                                 data=utils.merge_two_dicts(data, kwargs),
+                                 files=files)
 
         return response.headers["Location"].split("/")[-1]
 
-    def add_all(self, entity: str, entities: List[dict]) -> List[str]:
-        """Adds multiple entity rows to an entity repository."""
-        response = self._session.post(self._api_url + "v2/" + quote_plus(entity),
-                                      headers=self._headers.ct_token_header,
-                                      data=json.dumps({"entities": entities}))
+    def add_all(self,
+                entity: str,
+                entities: List[dict],
+                journal: Union[str, Path, Journal] = None,
+                progress: Callable[[Progress], None] = None) -> List[str]:
+        """Adds multiple entity rows to an entity repository. The rows are sent in concurrent batches of at most
+        1000 rows, the maximum the REST API v2 accepts, so rows should not refer to rows in another batch.
 
-        try:
-            response.raise_for_status()
-        except requests.RequestException as ex:
-            raise_exception(ex)
+        Args:
+        entity -- fully qualified name of the entity
+        entities -- the entity rows to add
+        journal -- a Journal or the path of a journal file in which the committed batches are recorded. When
+        add_all is run again with the same rows and journal, the batches that were committed are skipped.
+        progress -- a function that is called with the Progress (in rows) while the batches are sent
+        """
+        tracker = ProgressTracker.of(progress, "add_all", entity, len(entities))
+        return self._add_all(entity, entities, open_journal(journal), tracker)
+
+    def _add_all(self, entity: str, entities: List[dict], journal: Optional[Journal],
+                 tracker: Optional[ProgressTracker]) -> List[str]:
+        """Adds multiple entity rows in concurrent batches, reporting the rows that are done to the tracker."""
+        self._ref_cache.pop(entity, None)
+
+        def add_batch(index: int, batch: List[dict]) -> List[str]:
+            ids = self._journaled(journal, "add_all", entity, index, batch, lambda: self._add_batch(entity, batch),
+                                  start=index * MAX_BATCH_SIZE)
+            if tracker:
+                tracker.advance(len(batch))
+            return ids
+
+        batches = self._map_concurrently(lambda numbered: add_batch(*numbered),
+                                         enumerate(utils.chunks(entities, MAX_BATCH_SIZE)))
+        return [id_ for ids in batches for id_ in ids]
+
+    def _add_batch(self, entity: str, entities: List[dict]) -> List[str]:
+        """Adds a batch of at most 1000 entity rows to an entity repository."""
+        response = self._request("POST", self._api_url + "v2/" + quote_plus(entity),
+                                 headers=self._headers.ct_token_header,
+                                 data=json.dumps({"entities": entities}, default=json_default))
 
         return [resource["href"].split("/")[-1] for resource in response.json()["resources"]]
 
+    def add_all_with_files(self, entity: str, entities: List[dict]) -> List[str]:
+        """Adds multiple entity rows with file attributes to an entity repository, one request per row, sent
+        concurrently. The file attribute values are paths of files on disk, which are opened when their row is sent.
+        When requests-toolbelt is installed, the files are streamed from disk, otherwise they are read into memory.
+
+        Args:
+        entity -- fully qualified name of the entity
+        entities -- the entity rows, mapping the file attributes to file paths and the other attributes to values
+
+        Returns the identifiers of the added rows.
+
+        Examples:
+        >>> session.add_all_with_files('Plot', [{'name': 'IBD-plot', 'image': '/Users/me/first-plot.jpg'},
+        ...                                     {'name': 'UC-plot', 'image': '/Users/me/second-plot.jpg'}])
+        """
+        file_attrs = {attr["data"]["name"] for attr in self._get_cached_meta(entity)["attributes"]["items"]
+                      if attr["data"]["type"].lower() == "file"}
+        self._ref_cache.pop(entity, None)
+        return self._map_concurrently(lambda row: self._add_with_files(entity, row, file_attrs), entities)
+
+    def _add_with_files(self, entity: str, row: dict, file_attrs: set) -> str:
+        """Adds a single entity row, opening the files its file attributes refer to."""
+        data = {name: value for name, value in row.items() if name not in file_attrs}
+        with ExitStack() as stack:
+            files = {name: (Path(path).name, stack.enter_context(open(path, 'rb')))
+                     for name, path in row.items() if name in file_attrs and path is not None}
+            if MultipartEncoder is None:
+                return self.add(entity, data=data, files=files)
+
+            # Like requests does for add, leave out missing values
+            fields = [(name, str(item)) for name, value in data.items()
+                      for item in (value if isinstance(value, list) else [value]) if item is not None]
+            encoder = MultipartEncoder(fields=fields + list(files.items()))
+            response = self._request("POST", self._api_url + "v1/" + quote_plus(entity),
+                                     headers=utils.merge_two_dicts(self._headers.token_header,
+                                                                   {"Content-Type": encoder.content_type}),
+                                     data=encoder)
+            return response.headers["Location"].split("/")[-1]
+
+    def download_files(self,
+                       entity: str,
+                       directory: Union[str, Path],
+                       q: str = None,
+                       attributes: str = None,
+                       chunk_size: int = 1024 * 1024) -> Dict[str, Dict[str, Path]]:
+        """Downloads the contents of the file attributes of the rows matching a query to a directory. The files are
+        downloaded concurrently and streamed to disk. Every file is stored as <directory>/<file id>/<file name>.
+
+        Args:
+        entity -- fully qualified name of the entity
+        directory -- the directory to store the files in, created when it does not exist
+        q -- query in rsql format, see our RSQL documentation for details
+        attributes -- comma separated file attributes to download, defaults to all file attributes
+        chunk_size -- the number of bytes to read into memory at once
+
+        Returns the paths of the downloaded files, mapped by row identifier and attribute name.
+
+        Examples:
+        >>> session.download_files('Plot', '/Users/me/plots', q='name=like=IBD')
+        {'1': {'image': PosixPath('/Users/me/plots/aaaac3jmq/first-plot.jpg')}}
+        """
+        meta = self._get_cached_meta(entity)
+        id_attr = utils.get_id_attribute(meta)
+        file_attrs = [attr["data"]["name"] for attr in meta["attributes"]["items"]
+                      if attr["data"]["type"].lower() == "file"]
+        if attributes:
+            file_attrs = [name for name in file_attrs if name in attributes.split(',')]
+        rows = self.get(entity, q=q, attributes=','.join([id_attr] + file_attrs), expand=','.join(file_attrs))
+
+        directory = Path(directory)
+        downloads = [(row[id_attr], name, row[name]) for row in rows for name in file_attrs if row.get(name)]
+        paths = self._map_concurrently(lambda download: self._download_file(download[2], directory, chunk_size),
+                                       downloads)
+
+        result = {}
+        for (id_, name, _), path in zip(downloads, paths):
+            result.setdefault(id_, {})[name] = path
+        return result
+
+    def _download_file(self, file_meta: dict, directory: Path, chunk_size: int) -> Path:
+        """Streams the contents of a file to <directory>/<file id>/<file name>."""
+        # The url stored in the FileMeta may point to another host, the token must only be sent to this server
+        url = self._root_url + "files/" + quote(file_meta["id"], safe="")
+        # The file name is chosen by the uploader, only its last part is used so that it can't point outside directory
+        path = directory / _safe_file_name(file_meta["id"]) / _safe_file_name(file_meta["filename"])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(path.name + ".part")
+        with self._request("GET", url, headers=self._headers.token_header, stream=True) as response:
+            with open(partial, "wb") as file:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    file.write(chunk)
+        partial.replace(path)
+        return path
+
     def update_one(self, entity: str, id_: str, attr: str, value: Any) -> requests.Response:
         """Updates one attribute of a given entity in a table with a given value"""
-        response = self._session.put(self._api_url + "v1/" + quote_plus(entity) + "/" + id_ + "/" + attr,
-                                     headers=self._headers.ct_token_header,
-                                     data=json.dumps(value))
-
-        try:
-            response.raise_for_status()
-        except requests.RequestException as ex:
-            raise_exception(ex)
+        self._ref_cache.pop(entity, None)
+        response = self._request("PUT", self._api_url + "v1/" + quote_plus(entity) + "/" + id_ + "/" + attr,
+                                 headers=self._headers.ct_token_header,
+                                 data=json.dumps(value, default=json_default))
 
         return response
 
-    def update_all(self, entity: str, entities: List[dict]):
-        """Updates multiple entities."""
-        response = self._session.put(
+    def update_attributes(self, entity: str, changes: Dict[str, Dict[str, Any]]) -> int:
+        """Updates some attributes of multiple entity rows, leaving their other attributes as they are. The changes
+        are grouped by attribute and sent with the REST API v2, in concurrent batches of at most 1000 rows per
+        attribute. The attributes are updated one after the other, because the server rewrites the complete row when
+        it updates an attribute. File attributes, and all attributes on servers that don't support updating an
+        attribute of multiple rows, are updated with one update_one request per row.
+
+        Args:
+        entity -- fully qualified name of the entity
+        changes -- maps the identifiers of the rows to the new values of their changed attributes
+
+        Returns the number of updated rows.
+
+        Examples:
+        >>> session.update_attributes('Person', {'jan': {'city': 'grn', 'age': 31}, 'els': {'city': 'ams'}})
+        """
+        meta = self._get_cached_meta(entity)
+        id_attr = utils.get_id_attribute(meta)
+        file_attrs = {attr["data"]["name"] for attr in meta["attributes"]["items"]
+                      if attr["data"]["type"].lower() == "file"}
+        values_by_attr = {}
+        for id_, values in changes.items():
+            for attr, value in values.items():
+                values_by_attr.setdefault(attr, []).append((id_, value))
+
+        self._ref_cache.pop(entity, None)
+        for attr, values in values_by_attr.items():
+            if attr in file_attrs or not self._update_attribute(entity, id_attr, attr, values):
+                self._map_concurrently(lambda id_value: self.update_one(entity, id_value[0], attr, id_value[1]),
+                                       values)
+        return len(changes)
+
+    def _update_attribute(self, entity: str, id_attr: str, attr: str, values: List[Tuple[str, Any]]) -> bool:
+        """Updates an attribute of multiple rows in concurrent batches of at most 1000. Returns False, without
+        updating anything, when the server doesn't support updating an attribute of multiple rows."""
+        url = self._api_url + "v2/" + quote_plus(entity) + "/" + quote_plus(attr)
+
+        def update_batch(batch: List[Tuple[str, Any]]) -> requests.Response:
+            return self._request("PUT", url, headers=self._headers.ct_token_header,
+                                 data=json.dumps({"entities": [{id_attr: id_, attr: value} for id_, value in batch]},
+                                                 default=json_default))
+
+        batches = utils.chunks(values, MAX_BATCH_SIZE)
+        try:
+            # The first batch tells whether the server supports it
+            update_batch(batches[0])
+        except MolgenisRequestError as ex:
+            # Without the endpoint the URL matches the one of a single row, which doesn't allow PUT. A 404 means an
+            # unknown entity type or row instead.
+            if _status_code(ex) == 405:
+                return False
+            raise
+        self._map_concurrently(update_batch, batches[1:])
+        return True
+
+    def update_all(self,
+                   entity: str,
+                   entities: List[dict],
+                   progress: Callable[[Progress], None] = None) -> requests.Response:
+        """Updates multiple entities. The rows are sent in concurrent batches of at most 1000 rows, the maximum the
+        REST API v2 accepts. Returns the response of the last batch. The optional progress function is called with
+        the Progress (in rows) while the batches are sent."""
+        return self._update_all(entity, entities, ProgressTracker.of(progress, "update_all", entity, len(entities)))
+
+    def _update_all(self, entity: str, entities: List[dict], tracker: Optional[ProgressTracker]) -> requests.Response:
+        """Updates multiple entities in concurrent batches, reporting the rows that are done to the tracker."""
+        self._ref_cache.pop(entity, None)
+
+        def update_batch(batch: List[dict]) -> requests.Response:
+            response = self._update_batch(entity, batch)
+            if tracker:
+                tracker.advance(len(batch))
+            return response
+
+        responses = self._map_concurrently(update_batch, utils.chunks(entities, MAX_BATCH_SIZE))
+        return responses[-1] if responses else None
+
+    def _update_batch(self, entity: str, entities: List[dict]) -> requests.Response:
+        """Updates a batch of at most 1000 entities."""
+        return self._request(
+            "PUT",
             self._api_url + "v2/" + quote_plus(entity),
             headers=self._headers.ct_token_header,
-            data=json.dumps({"entities": entities}),
+            data=json.dumps({"entities": entities}, default=json_default),
         )
 
-        try:
-            response.raise_for_status()
-        except requests.RequestException as ex:
-            raise_exception(ex)
-
-        return response
-
-    def upsert(self, entity_type_id: str, entities: List[dict]):
+    def upsert(self,
+               entity_type_id: str,
+               entities: List[dict],
+               diff: bool = False,
+               existing: Iterable[dict] = None,
+               journal: Union[str, Path, Journal] = None,
+               progress: Callable[[Progress], None] = None) -> dict:
         """
         Upserts entities in an entity type.
         @param entity_type_id: the id of the entity type to upsert to
         @param entities: the entities to upsert
+        @param diff: when true, existing entities are only updated when their values changed. Entities are compared
+        with the current rows on the attributes they contain, using stable hashes of the values normalized by the types
+        of the attributes (so that e.g. numbers are compared by value and datetimes in UTC)
+        @param existing: the current rows of the entity type in upload format (e.g. from a SQLiteMirror), to use
+        instead of retrieving them
+        @param journal: a Journal or the path of a journal file. When given, the entities are upserted in consecutive
+        chunks of 1000 and every committed chunk is recorded, so that a rerun with the same entities skips them
+        @param progress: a function that is called with the Progress (in rows) while the entities are upserted
+        @return: the number of added, updated and unchanged entities
         """
-        # Get the existing identifiers
-        meta = self.get_entity_meta_data(entity_type_id)
-        id_attr = meta["idAttribute"]
-        existing_entities = self.get(entity_type_id, batch_size=10000, attributes=id_attr)
-        existing_ids = {entity[id_attr] for entity in existing_entities}
-
-        # Based on the existing identifiers, decide which rows should be added/updated
+        meta = self._get_cached_meta(entity_type_id)
+        id_attr = utils.get_id_attribute(meta)
+        if existing is None:
+            if diff:
+                # Get the current values of the attributes that are upserted
+                upserted_attrs = {id_attr}.union(*entities)
+                attributes = [attr for attr in self._get_attribute_names(entity_type_id) if attr in upserted_attrs]
+                existing = self.get(entity_type_id, batch_size=10000, attributes=','.join(attributes),
+                                    uploadable=True)
+            else:
+                # Get the existing identifiers
+                existing = self.get(entity_type_id, batch_size=10000, attributes=id_attr)
+        existing_rows = {row[id_attr]: row for row in existing}
+
+        journal = open_journal(journal)
+        tracker = ProgressTracker.of(progress, "upsert", entity_type_id, len(entities))
+        chunks = utils.chunks(entities, MAX_BATCH_SIZE) if journal else [entities]
+        # With a journal, chunks may be skipped, so progress is reported per chunk instead of per batch
+        batch_tracker = None if journal else tracker
+        results = []
+        for index, chunk in enumerate(chunks):
+            result = self._journaled(journal, "upsert", entity_type_id, index, chunk,
+                                     lambda: self._upsert_chunk(entity_type_id, chunk, meta, existing_rows, diff,
+                                                                batch_tracker),
+                                     start=index * MAX_BATCH_SIZE)
+            results.append(result)
+            if tracker and journal:
+                tracker.advance(len(chunk))
+        if tracker:
+            tracker.finish()
+        return {key: sum(result[key] for result in results) for key in ("added", "updated", "unchanged")}
+
+    def _upsert_chunk(self, entity_type_id: str, entities: List[dict], meta: dict, existing_rows: dict,
+                      diff: bool, tracker: Optional[ProgressTracker] = None) -> dict:
+        """Adds the entities that don't exist yet and updates the others (unless they are unchanged)."""
+        id_attr = utils.get_id_attribute(meta)
+        types = utils.get_attribute_types(meta)
+
+        # Based on the existing identifiers (and values), decide which rows should be added/updated
         add = list()
         update = list()
+        unchanged = 0
         for entity in entities:
-            if id_attr in entity and entity[id_attr] in existing_ids:
+            if id_attr in entity and entity[id_attr] in existing_rows:
+                if diff and utils.row_hash(entity, types=types) == utils.row_hash(existing_rows[entity[id_attr]],
+                                                                                  entity.keys(), types):
+                    unchanged += 1
+                else:
                     update.append(entity)
             else:
                 add.append(entity)
@@ -313,54 +1150,150 @@ class Session:
         add = utils.remove_one_to_manys(add, meta)
 
         # Do the adds and updates separately
-        self.add_all(entity_type_id, add)
-        self.update_all(entity_type_id, update)
+        if tracker:
+            tracker.advance(unchanged)
+        self._add_all(entity_type_id, add, None, tracker)
+        self._update_all(entity_type_id, update, tracker)
+        return {"added": len(add), "updated": len(update), "unchanged": unchanged}
+
+    def _upsert_batch(self, entity: str, entities: List[dict]) -> dict:
+        """Upserts a batch of entity rows, retrieving only the existing identifiers among those of the batch instead
+        of all identifiers of the entity type."""
+        id_attr = utils.get_id_attribute(self._get_cached_meta(entity))
+        ids = [str(row[id_attr]) for row in entities if row.get(id_attr) is not None]
+        existing = self._get_where_in(entity, id_attr, ids, id_attr, sort_column=id_attr) if ids else []
+        return self.upsert(entity, entities, existing=existing)
+
+    def load(self, data: Dict[str, List[dict]]) -> Dict[str, List[str]]:
+        """Adds the rows of multiple entity types that refer to each other, in the order of their references. The
+        rows of an entity type are added with add_all as soon as the entity types it refers to have been added, so
+        entity types that don't depend on each other are added concurrently. Values of attributes that refer to the
+        entity type itself are left out when the rows are added and set afterwards with update_all.
+
+        Args:
+        data -- maps the fully qualified names of the entity types to their rows (in upload format)
+
+        Returns the identifiers of the added rows, mapped by entity type.
+
+        Raises a ValueError when entity types refer to each other circularly.
+
+        Examples:
+        >>> session.load({'Person': [{'id': 'jan', 'city': 'grn', 'partner': 'els'}, {'id': 'els', 'city': 'grn'}],
+        ...               'City': [{'id': 'grn', 'name': 'Groningen'}]})
+        {'City': ['grn'], 'Person': ['jan', 'els']}
+        """
+        metas = dict(zip(data, self._map_concurrently(self._get_cached_meta, data)))
+        dependencies = utils.get_dependencies(metas)
+        circular = [group for group in utils.dependency_groups(dependencies) if len(group) > 1]
+        if circular:
+            raise ValueError("Circular references between entity types: {}".format(
+                "; ".join(", ".join(group) for group in circular)))
+
+        def add_rows(entity: str) -> List[str]:
+            self_refs = {attr["data"]["name"] for attr in metas[entity]["attributes"]["items"]
+                         if utils.get_ref_entity_type_id(attr["data"]) == entity}
+            rows = data[entity]
+            if not self_refs:
+                return self.add_all(entity, rows)
+
+            ids = self.add_all(entity, [{name: value for name, value in row.items() if name not in self_refs}
+                                        for row in rows])
+            # Updating replaces the whole row, so send the complete rows that have self-references
+            self.update_all(entity, [row for row in rows if any(row.get(name) for name in self_refs)])
+            return ids
+
+        return self._map_in_dependency_order(add_rows, dependencies)
+
+    def writer(self,
+               entity: str,
+               mode: str = "add",
+               batch_size: int = MAX_BATCH_SIZE,
+               flush_interval: float = 5.0,
+               max_pending: int = None) -> Writer:
+        """Returns a Writer, a write-behind buffer for rows that are produced one at a time. The rows are written in
+        the background in batches with add_all, update_all or upsert, when a batch is full or when its oldest row has
+        waited for flush_interval seconds. Use it as a context manager to write the remaining rows at the end.
+
+        Args:
+        entity -- fully qualified name of the entity
+        mode -- 'add', 'update' or 'upsert'
+        batch_size -- the number of rows to write at once
+        flush_interval -- the maximum number of seconds a row is buffered, None to only write full batches
+        max_pending -- the maximum number of batches being written or waiting to be written before writing blocks,
+        defaults to max_concurrency
+
+        Examples:
+        >>> with session.writer('Person') as writer:
+        ...     for person in consume_persons():
+        ...         writer.write(person)
+        """
+        return Writer(self, entity, mode, batch_size, flush_interval, max_pending or self._max_concurrency)
 
     def delete(self, entity: str, id_: str = None) -> requests.Response:
         """Deletes a single entity row or all rows (if id_ not specified) from an entity repository."""
+        self._ref_cache.pop(entity, None)
         url = self._api_url + "v1/" + quote_plus(entity)
         if id_:
             url = url + "/" + quote_plus(id_)
 
-        response = self._session.delete(url, headers=self._headers.token_header)
-        try:
-            response.raise_for_status()
-        except requests.RequestException as ex:
-            raise_exception(ex)
+        response = self._request("DELETE", url, headers=self._headers.token_header)
 
         return response
 
     def delete_list(self, entity: str, entities: List[str]) -> requests.Response:
-        """Deletes multiple entity rows to an entity repository, given a list of id's."""
-        response = self._session.delete(self._api_url + "v2/" + quote_plus(entity),
-                                        headers=self._headers.ct_token_header,
-                                        data=json.dumps({"entityIds": entities}))
-        try:
-            response.raise_for_status()
-        except requests.RequestException as ex:
-            raise_exception(ex)
+        """Deletes multiple entity rows to an entity repository, given a list of id's. The id's are sent in
+        concurrent batches of at most 1000, the maximum the REST API v2 accepts. Returns the response of the last
+        batch."""
+        return self._delete_list(entity, entities, None)
 
-        return response
+    def delete_where(self, entity: str, q: str, progress: Callable[[Progress], None] = None) -> int:
+        """Deletes the entity rows that match a query and returns the number of deleted rows. Only the identifiers
+        of the matching rows are retrieved, all of them before the first row is deleted, because deleting rows
+        shifts the pages of the query. They are then deleted in concurrent batches of at most 1000.
+
+        Args:
+        entity -- fully qualified name of the entity
+        q -- query in rsql format selecting the rows to delete, see get
+        progress -- a function that is called with the Progress (in rows) while the batches are deleted
+
+        Examples:
+        >>> session.delete_where('Person', 'age=lt=0')
+        """
+        if not q:
+            raise ValueError("A query is required, use delete to delete all rows of '{}'".format(entity))
+        id_attr = utils.get_id_attribute(self._get_cached_meta(entity))
+        ids = [row[id_attr] for row in self.get(entity, q=q, attributes=id_attr, batch_size=10000)]
+        self._delete_list(entity, ids, ProgressTracker.of(progress, "delete_where", entity, len(ids)))
+        return len(ids)
+
+    def _delete_list(self, entity: str, ids: List[str], tracker: Optional[ProgressTracker]) -> requests.Response:
+        """Deletes entity rows in concurrent batches, reporting the rows that are done to the tracker."""
+        self._ref_cache.pop(entity, None)
+
+        def delete_batch(batch: List[str]) -> requests.Response:
+            response = self._request("DELETE", self._api_url + "v2/" + quote_plus(entity),
+                                     headers=self._headers.ct_token_header,
+                                     data=json.dumps({"entityIds": batch}))
+            if tracker:
+                tracker.advance(len(batch))
+            return response
+
+        responses = self._map_concurrently(delete_batch, utils.chunks(ids, MAX_BATCH_SIZE))
+        if tracker:
+            tracker.finish()
+        return responses[-1] if responses else None
 
     def get_entity_meta_data(self, entity: str) -> dict:
         """Retrieves the metadata for an entity repository."""
-        response = self._session.get(self._api_url + "v1/" + quote_plus(entity) + "/meta?expand=attributes",
-                                     headers=self._headers.token_header)
-        try:
-            response.raise_for_status()
-        except requests.RequestException as ex:
-            raise_exception(ex)
+        response = self._request("GET", self._api_url + "v1/" + quote_plus(entity) + "/meta?expand=attributes",
+                                 headers=self._headers.token_header)
 
         return response.json()
 
     def get_attribute_meta_data(self, entity: str, attribute: str) -> dict:
         """Retrieves the metadata for a single attribute of an entity repository."""
-        response = self._session.get(self._api_url + "v1/" + quote_plus(entity) + "/meta/" + quote_plus(attribute),
-                                     headers=self._headers.token_header)
-        try:
-            response.raise_for_status()
-        except requests.RequestException as ex:
-            raise_exception(ex)
+        response = self._request("GET", self._api_url + "v1/" + quote_plus(entity) + "/meta/" + quote_plus(attribute),
+                                 headers=self._headers.token_header)
 
         return response.json()
 
@@ -370,96 +1303,237 @@ class Session:
         If expand is true, the metadata of the ref entities will be returned also.
         If abstract is true, the metadata of the parent entity will be returned also.
         """
-        response = self._session.get(
+        response = self._request(
+            "GET",
             self._api_url + "metadata/" + quote_plus(entity_type_id) + "?flattenAttributes="+str(abstract),
             headers=self._headers.token_header,
         )
 
-        try:
-            response.raise_for_status()
-        except requests.RequestException as ex:
-            raise_exception(ex)
-
         meta = response.json()["data"]
 
         if expand:
-            for item in meta["attributes"]["items"]:
-                if "refEntityType" in item["data"]:
-                    ref_url = item["data"]["refEntityType"]["self"]
-                    ref_entity = ref_url[ref_url.rindex("/"):].replace("/", "")
-                    item["data"]["refEntityType"] = self.get_meta(ref_entity, abstract=True)
+            ref_items = [item for item in meta["attributes"]["items"] if utils.get_ref_entity_type_id(item["data"])]
+            ref_metas = self._map_concurrently(
+                lambda item: self.get_meta(utils.get_ref_entity_type_id(item["data"]), abstract=True), ref_items)
+            for item, ref_meta in zip(ref_items, ref_metas):
+                item["data"]["refEntityType"] = ref_meta
 
         return meta
 
+    def prefetch_meta(self, package_id: str) -> List[str]:
+        """Retrieves the metadata of all entity types in a package and its subpackages with a few bulk queries on
+        the system metadata tables, instead of one request per entity type, and caches it in the same form as
+        get_meta(abstract=True) returns. Later calls that need the metadata of these entity types, e.g. get, upsert,
+        to_upload_format and import_data, don't retrieve it again. Only the attribute fields this client uses are
+        included. Returns the fully qualified names of the entity types in the package.
+
+        Examples:
+        >>> session.prefetch_meta('biobanks')
+        >>> session.upsert('biobanks_Sample', samples)
+        """
+        packages = [package_id]
+        subpackages = [package_id]
+        while subpackages:
+            subpackages = [row["id"] for row in self._get_where_in("sys_md_Package", "parent", subpackages, "id")]
+            packages.extend(subpackages)
+
+        entity_types = {row["id"]: row for row in self._get_where_in("sys_md_EntityType", "package", packages,
+                                                                      _ENTITY_TYPE_FIELDS)}
+        package_entity_types = sorted(entity_types)
+        # Entity types can extend entity types of other packages
+        parents = {_ref_id(row["extends"]) for row in entity_types.values() if row.get("extends")} - set(entity_types)
+        while parents:
+            rows = self._get_where_in("sys_md_EntityType", "id", sorted(parents), _ENTITY_TYPE_FIELDS)
+            entity_types.update((row["id"], row) for row in rows)
+            parents = {_ref_id(row["extends"]) for row in rows if row.get("extends")} - set(entity_types)
+
+        attributes = {entity_type: [] for entity_type in entity_types}
+        for row in self._get_where_in("sys_md_Attribute", "entity", sorted(entity_types), _ATTRIBUTE_FIELDS):
+            attributes[_ref_id(row["entity"])].append(row)
+
+        for entity_type_id in entity_types:
+            # Like flattenAttributes=true: the attributes of the parents come first
+            hierarchy = []
+            current = entity_type_id
+            while current:
+                hierarchy.insert(0, current)
+                current = _ref_id(entity_types[current].get("extends"))
+            items = [{"data": self._attribute_meta(row)} for entity_type in hierarchy
+                     for row in sorted(attributes[entity_type], key=lambda attribute: attribute.get("sequenceNr", 0))]
+            entity_type = entity_types[entity_type_id]
+            self._meta_cache[entity_type_id] = {"id": entity_type_id,
+                                                "label": entity_type.get("label"),
+                                                "description": entity_type.get("description"),
+                                                "abstract": entity_type.get("isAbstract", False),
+                                                "attributes": {"items": items}}
+        return package_entity_types
+
+    def _get_where_in(self, entity: str, attribute: str, values: List[str], attributes: str,
+                      sort_column: str = "id") -> List[dict]:
+        """Retrieves the rows of which an attribute has one of the values, querying concurrently for chunks of values
+        to keep the URLs short. The rows are sorted on sort_column (which should be unique) within a chunk."""
+        def get_chunk(chunk: List[str]) -> List[dict]:
+            q = "{}=in=({})".format(attribute, ",".join(_rsql_string(value) for value in chunk))
+            return self.get(entity, q=q, attributes=attributes, batch_size=10000, sort_column=sort_column)
+
+        return [row for rows in self._map_concurrently(get_chunk, utils.chunks(values, 100)) for row in rows]
+
+    def _attribute_meta(self, row: dict) -> dict:
+        """Converts a row of sys_md_Attribute to the attribute data of the Metadata API."""
+        data = {"id": row["id"],
+                "name": row["name"],
+                "sequenceNr": row.get("sequenceNr"),
+                "type": row["type"].lower(),
+                "idAttribute": row.get("isIdAttribute", False),
+                "labelAttribute": row.get("isLabelAttribute", False),
+                "lookupAttributeIndex": row.get("lookupAttributeIndex"),
+                "nullable": row.get("isNullable", True),
+                "auto": row.get("isAuto", False),
+                "readOnly": row.get("isReadOnly", False),
+                "unique": row.get("isUnique", False),
+                "label": row.get("label"),
+                "description": row.get("description")}
+        if row.get("enumOptions"):
+            data["enumOptions"] = row["enumOptions"].split(",")
+        if row.get("refEntityType"):
+            data["refEntityType"] = {"self": self._api_url + "metadata/" + _ref_id(row["refEntityType"])}
+        return data
+
     def to_upload_format(self, entity_type_id: str, rows: List[dict], ) -> List[dict]:
         """
         Changes the output of the REST Client such that it can be uploaded again:
         1. Non-data fields are removed (_href and _meta).
         2. Reference objects are removed and replaced with their identifiers.
         """
-        meta = self.get_meta(entity_type_id, expand=True, abstract=True)
-        upload_format = []
-        ref_ids = {}
-        # Get the idAttributes of the refEntities
-        for attr in meta["attributes"]["items"]:
-            if "refEntityType" in attr["data"]:
-                for ref_attr in attr["data"]["refEntityType"]["attributes"]["items"]:
-                    if ref_attr["data"]["idAttribute"] is True:
-                        ref_ids[attr["data"]["name"]] = ref_attr["data"]["name"]
-
-        for row in rows:
-            # Remove non-data fields
-            row.pop("_href", None)
-            row.pop("_meta", None)
-
-            for attr in row:
-                if type(row[attr]) is dict:
-                    # Change xref dicts to id
-                    ref = row[attr][ref_ids[attr]]
-                    row[attr] = ref
-                elif type(row[attr]) is list and len(row[attr]) > 0:
-                    # Change mref list of dicts to list of ids
-                    mref = [ref[ref_ids[attr]] for ref in row[attr]]
-                    row[attr] = mref
-
-            upload_format.append(row)
-        return upload_format
+        return utils.to_upload_format(rows, self._get_ref_id_attributes(entity_type_id))
+
+    def _get_ref_id_attributes(self, entity_type_id: str) -> dict:
+        """Maps the reference attributes of an entity type to the idAttribute of the entity type they refer to."""
+        ref_entities = {attr["data"]["name"]: utils.get_ref_entity_type_id(attr["data"])
+                        for attr in self._get_cached_meta(entity_type_id)["attributes"]["items"]
+                        if utils.get_ref_entity_type_id(attr["data"])}
+        # Retrieve the metadata of the reference entities that aren't cached yet concurrently
+        self._map_concurrently(self._get_cached_meta, set(ref_entities.values()) - set(self._meta_cache))
+        return {attr: utils.get_id_attribute(self._get_cached_meta(ref_entity))
+                for attr, ref_entity in ref_entities.items()}
 
     def upload_zip(self,
                    meta_data_zip: str,
                    data_action: ImportDataAction = ImportDataAction.ADD,
                    metadata_action: ImportMetadataAction = ImportMetadataAction.UPSERT,
-                   asynchronous: bool = True) -> str:
+                   asynchronous: bool = True,
+                   progress: Callable[[Progress], None] = None) -> str:
         """Uploads a given zip with data and/or metadata
         If asynchronous is True it does not wait till the upload is finished.
         Options for metadata_action are: [ADD, UPDATE, UPSERT, IGNORE]
         Options for data_action are: [ADD, ADD_UPDATE_EXISTING, UPDATE, ADD_IGNORE_EXISTING]
+        The optional progress function is called with the Progress of the upload in bytes. The progress is only
+        reported while uploading when requests-toolbelt is installed, otherwise when the upload has finished.
         """
-
+        # The archive may change any entity type, the metadata only when it is not ignored
+        self._ref_cache.clear()
+        if metadata_action != ImportMetadataAction.IGNORE:
+            self._meta_cache.clear()
+        return self._upload_zip(meta_data_zip, data_action, metadata_action, asynchronous, progress)
+
+    def _upload_zip(self,
+                    meta_data_zip: str,
+                    data_action: ImportDataAction,
+                    metadata_action: ImportMetadataAction,
+                    asynchronous: bool,
+                    progress: Callable[[Progress], None] = None) -> str:
+        """Uploads a zip like upload_zip, without clearing the caches."""
         params = {"action": data_action.value, "metadataAction": metadata_action.value}
-        with open(os.path.abspath(meta_data_zip), 'rb') as zip_file:
-            files = {'file': zip_file}
+        path = os.path.abspath(meta_data_zip)
+        tracker = ProgressTracker.of(progress, "upload_zip", os.path.basename(path), os.path.getsize(path), "bytes")
+        with open(path, 'rb') as zip_file:
             url = self._root_url + 'plugin/importwizard/importFile'
-            response = requests.post(url, headers=self._headers.token_header, files=files, params=params)
-        try:
-            response.raise_for_status()
-        except requests.RequestException as ex:
-            raise_exception(ex)
+            if tracker and MultipartEncoder is not None:
+                monitor = MultipartEncoderMonitor(MultipartEncoder(fields={'file': (os.path.basename(path), zip_file)}),
+                                                  lambda read: tracker.advance(read.bytes_read - tracker.done))
+                tracker.total = monitor.len
+                headers = utils.merge_two_dicts(self._headers.token_header, {"Content-Type": monitor.content_type})
+                response = self._request("POST", url, headers=headers, data=monitor, params=params)
+            else:
+                files = {'file': zip_file}
+                response = self._request("POST", url, headers=self._headers.token_header, files=files, params=params)
+                if tracker:
+                    tracker.advance(tracker.total)
 
         if not asynchronous:
             self._await_import_job(response.text.split("/")[-1])
 
         return response.content.decode("utf-8")
 
-    def import_data(self, data: dict, data_action: ImportDataAction, metadata_action: ImportMetadataAction):
+    def import_data(self,
+                    data: dict,
+                    data_action: ImportDataAction,
+                    metadata_action: ImportMetadataAction,
+                    split: bool = False,
+                    journal: Union[str, Path, Journal] = None,
+                    progress: Callable[[Progress], None] = None):
+        """Imports the rows of multiple entity types as an EMX archive and waits until the import has finished.
+
+        Args:
+        data -- maps the fully qualified names of the entity types to their rows (in upload format)
+        data_action -- see upload_zip
+        metadata_action -- see upload_zip
+        split -- when true, every entity type is imported as a separate archive. Entity types that refer to each
+        other circularly share an archive. Archives are imported concurrently, but an archive is only imported when
+        the archives of the entity types it refers to have been imported.
+        journal -- a Journal or the path of a journal file in which the imported archives are recorded. When
+        import_data is run again with the same data and journal, the archives that were imported are skipped.
+        progress -- a function that is called with the Progress (in rows) when an archive has been imported
+        """
+        try:
+            self._import_data(data, data_action, metadata_action, split, open_journal(journal), progress)
+        finally:
+            # Only the imported entity types change. Clearing their cache entries once, instead of in every upload,
+            # keeps the metadata that concurrent archives still need (e.g. loaded with prefetch_meta).
+            for entity in data:
+                self._ref_cache.pop(entity, None)
+                if metadata_action != ImportMetadataAction.IGNORE:
+                    self._meta_cache.pop(entity, None)
+
+    def _import_data(self, data: dict, data_action: ImportDataAction, metadata_action: ImportMetadataAction,
+                     split: bool, journal: Optional[Journal], progress: Optional[Callable[[Progress], None]]):
+        tracker = ProgressTracker.of(progress, "import_data", ",".join(data), sum(len(rows) for rows in data.values()))
         with tempfile.TemporaryDirectory() as tmpdir:
-            archive = self._create_emx_archive(data, tmpdir)
-            self.upload_zip(
-                archive,
-                data_action,
-                metadata_action,
-                asynchronous=False
-            )
+            if not split:
+                self._journaled(journal, "import_data", ",".join(data), 0, data,
+                                lambda: self._import_archive(data, tmpdir, data_action, metadata_action))
+                if tracker:
+                    tracker.advance(tracker.total)
+                return
+
+            metas = dict(zip(data, self._map_concurrently(self._get_cached_meta, data)))
+            dependencies = utils.get_dependencies(metas)
+            groups = utils.dependency_groups(dependencies)
+            group_numbers = {entity: number for number, group in enumerate(groups) for entity in group}
+            group_dependencies = {number: {group_numbers[ref] for entity in group for ref in dependencies[entity]}
+                                  for number, group in enumerate(groups)}
+
+            def import_group(number: int):
+                directory = os.path.join(tmpdir, str(number))
+                os.mkdir(directory)
+                group_data = {entity: data[entity] for entity in groups[number]}
+                self._journaled(journal, "import_data", ",".join(group_data), number, group_data,
+                                lambda: self._import_archive(group_data, directory, data_action, metadata_action))
+                if tracker:
+                    tracker.advance(sum(len(rows) for rows in group_data.values()))
+
+            self._map_in_dependency_order(import_group, group_dependencies)
+
+    def _import_archive(self, data: dict, directory: str, data_action: ImportDataAction,
+                        metadata_action: ImportMetadataAction):
+        """Creates an EMX archive of the rows of one or more entity types in a directory and imports it."""
+        archive = self._create_emx_archive(data, directory)
+        self._upload_zip(
+            archive,
+            data_action,
+            metadata_action,
+            asynchronous=False
+        )
 
     def _create_emx_archive(self, data: dict, directory: str) -> Path:
         archive_name = f"{directory}/archive.zip"
@@ -467,7 +1541,8 @@ class Session:
             for table_name in data.keys():
                 meta_attributes = [
                     attr["data"]["name"] for attr in
-                    self.get_meta(entity_type_id=table_name)["attributes"]["items"]
+                    self._get_cached_meta(table_name)["attributes"]["items"]
+                    if attr["data"]["type"].lower() != "compound"
                 ]
                 file_name = f"{table_name}.csv"
                 file_path = f"{directory}/{file_name}"
@@ -493,3 +1568,33 @@ class Session:
         """
         self._root_url = url.rstrip('/').rstrip('/api') + '/'
         self._api_url = self._root_url + 'api/'
+
+
+def _apply_to_page(session: Session, func: Callable, entity: str, start: int, batch_size: int, q: str,
+                   options: dict) -> Any:
+    """Retrieves a page of entity rows and applies a function to it, runs in a worker process of map_pages."""
+    return func(session.get(entity, q=q, num=batch_size, start=start, batch_size=batch_size, **options))
+
+
+def _ref_id(value: Optional[dict]) -> Optional[str]:
+    """Returns the identifier of a reference to a system metadata row, which is a dict with the id of the row."""
+    return value["id"] if value else None
+
+
+def _status_code(ex: MolgenisRequestError) -> Optional[int]:
+    """Returns the HTTP status code of the response a MolgenisRequestError was raised for, if any."""
+    response = ex.args[1] if len(ex.args) > 1 else None
+    return getattr(response, "status_code", None)
+
+
+def _safe_file_name(name: str) -> str:
+    """Returns the last part of a file name or path, raising a ValueError when it is not a valid file name."""
+    safe_name = Path(name).name if name else ""
+    if safe_name in ("", ".", ".."):
+        raise ValueError("Invalid file name '{}'".format(name))
+    return safe_name
+
+
+def _rsql_string(value: str) -> str:
+    """Quotes a value for an RSQL query, percent-encoding it so that it can be used in the query string of a URL."""
+    return quote('"{}"'.format(value.replace("\\", "\\\\").replace('"', '\\"')), safe="")
@@ -0,0 +1,164 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+
+OVERLOADED_STATUS_CODES = {429, 503}
+
+
+def backoff_delay(attempt: int, retry_after: str = None) -> float:
+    """Returns the number of seconds to wait before retrying a request, honouring a Retry-After header in seconds."""
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return 0.5 * 2 ** attempt
+
+
+class RateLimiter:
+    """Token bucket that limits the number of requests per second."""
+
+    def __init__(self, requests_per_second: float):
+        self._rate = requests_per_second
+        self._capacity = max(1.0, requests_per_second)
+        self._tokens = self._capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """Limits the number of requests in flight, adjusting the limit to the observed server behaviour (AIMD).
+
+    The limit grows by one per round of successful requests (additive increase) and is halved when the server
+    responds with 429 Too Many Requests or 503 Service Unavailable (multiplicative decrease). When a latency exceeds
+    latency_tolerance times the moving average of the latencies, the limit is reduced more gently. Optionally, the
+    number of requests per second is capped as well.
+    """
+
+    def __init__(self,
+                 maximum: int = 8,
+                 minimum: int = 1,
+                 initial: int = None,
+                 latency_tolerance: float = 3.0,
+                 max_requests_per_second: float = None):
+        """Constructs a new AdaptiveLimiter.
+        Args:
+        maximum -- the maximum number of requests in flight
+        minimum -- the minimum number of requests in flight
+        initial -- the initial number of requests in flight, defaults to half of the maximum
+        latency_tolerance -- the factor by which a latency may exceed the average latency before the limit is reduced
+        max_requests_per_second -- an optional hard cap on the number of requests per second
+        """
+        self.maximum = maximum
+        self.minimum = minimum
+        self._limit = float(initial or max(minimum, maximum // 2))
+        self._latency_tolerance = latency_tolerance
+        self._rate_limiter = RateLimiter(max_requests_per_second) if max_requests_per_second else None
+        self._in_flight = 0
+        self._requests = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+        self._average_latency = None
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """The current maximum number of requests in flight."""
+        return int(self._limit)
+
+    def statistics(self) -> dict:
+        """Returns the number of requests that were released and their mean and maximum latency in seconds."""
+        with self._condition:
+            return {"requests": self._requests,
+                    "mean_latency": self._total_latency / self._requests if self._requests else 0.0,
+                    "max_latency": self._max_latency}
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+        if self._rate_limiter:
+            self._rate_limiter.acquire()
+
+    def release(self, latency: float, overloaded: bool = False):
+        """Registers the outcome of a request that was acquired before.
+
+        Args:
+        latency -- the time in seconds it took to receive the response
+        overloaded -- whether the server indicated that it is overloaded
+        """
+        with self._condition:
+            self._in_flight -= 1
+            self._requests += 1
+            self._total_latency += latency
+            self._max_latency = max(self._max_latency, latency)
+            if overloaded:
+                self._decrease(0.5, latency)
+            else:
+                if self._average_latency is None:
+                    self._average_latency = latency
+                if latency > self._latency_tolerance * self._average_latency:
+                    self._decrease(0.9, latency)
+                else:
+                    self._limit = min(self.maximum, self._limit + 1 / self._limit)
+                self._average_latency += 0.1 * (latency - self._average_latency)
+            self._condition.notify_all()
+
+    def _decrease(self, factor: float, latency: float):
+        # Requests that were in flight together report the same congestion, so decrease at most once per round trip
+        now = time.monotonic()
+        if now - self._last_decrease >= latency:
+            self._limit = max(self.minimum, self._limit * factor)
+            self._last_decrease = now
+
+
+class SingleFlight:
+    """Lets concurrent calls with the same key share one execution: the first caller executes the function, callers
+    that arrive while it runs wait for it and receive the same result or exception.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """Returns the result of func, or of the call with the same key that is in flight."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as ex:
+            self._finish(key, future)
+            future.set_exception(ex)
+            raise
+        self._finish(key, future)
+        future.set_result(result)
+        return result
+
+    def forget(self):
+        """Lets calls that start from now on execute anew instead of joining the calls in flight, e.g. because the
+        data they read has changed since those started."""
+        with self._lock:
+            self._calls.clear()
+
+    def _finish(self, key: Hashable, future: Future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
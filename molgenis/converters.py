@@ -0,0 +1,62 @@
+import datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List
+
+
+def to_datetime(value: str) -> datetime.datetime:
+    """Parses a datetime in the ISO 8601 format of the server, e.g. 2020-01-02T03:04:05Z."""
+    # fromisoformat only accepts the Z suffix as of Python 3.11
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.datetime.fromisoformat(value)
+
+
+def _to_decimal(value: Any) -> Decimal:
+    # Convert via the shortest representation of the float, so that 0.1 becomes Decimal('0.1')
+    return Decimal(str(value))
+
+
+_CONVERTERS = {
+    "date": datetime.date.fromisoformat,
+    "date_time": to_datetime,
+    "decimal": _to_decimal,
+}
+
+
+def get_converters(meta: dict, attributes: Iterable[str] = None) -> Dict[str, Callable[[Any], Any]]:
+    """
+    Returns the functions that convert the JSON values of the attributes of an entity type to native Python types,
+    based on metadata retrieved with the Metadata API: DATE becomes datetime.date, DATE_TIME a timezone aware
+    datetime.datetime and DECIMAL decimal.Decimal. Values of other types are native already and need no converter.
+    """
+    converters = {}
+    for attribute in meta["attributes"]["items"]:
+        name = attribute["data"]["name"]
+        converter = _CONVERTERS.get(attribute["data"]["type"].lower())
+        if converter and (attributes is None or name in attributes):
+            converters[name] = converter
+    return converters
+
+
+def convert_rows(rows: List[dict], converters: Dict[str, Callable[[Any], Any]]) -> List[dict]:
+    """Converts the values of rows in place with the converters from get_converters."""
+    converters = list(converters.items())
+    for row in rows:
+        for name, convert in converters:
+            value = row.get(name)
+            if value is not None:
+                row[name] = convert(value)
+    return rows
+
+
+def json_default(value: Any) -> Any:
+    """Serializes the native Python types of converted values to JSON, pass it as default to json.dumps."""
+    if isinstance(value, datetime.datetime):
+        if value.utcoffset() == datetime.timedelta(0):
+            return value.replace(tzinfo=None).isoformat() + "Z"
+        return value.isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
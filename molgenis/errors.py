@@ -21,4 +21,4 @@ def raise_exception(ex):
         error_msg = '{}: {}'.format(message, error)
         raise MolgenisRequestError(error_msg, ex.response)
     else:
-        raise MolgenisRequestError('{}'.format(message))
+        raise MolgenisRequestError('{}'.format(message), ex.response)
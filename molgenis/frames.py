@@ -0,0 +1,91 @@
+from typing import Iterable, List
+
+_INTEGER_DTYPES = {"int": "Int32", "long": "Int64"}
+_CATEGORY_TYPES = {"categorical", "enum"}
+_REF_TYPES = {"xref", "categorical", "file"}
+_MREF_TYPES = {"mref", "categorical_mref", "one_to_many"}
+
+
+class FrameBuilder:
+    """Builds a pandas DataFrame from pages of entity rows, converting every page to typed columns as it arrives,
+    based on the attribute types in the entity metadata.
+
+    INT and LONG become nullable integers, DECIMAL floats, BOOL nullable booleans, DATE and DATE_TIME datetimes,
+    CATEGORICAL and ENUM categories. References are replaced by their identifiers, (m)refs by lists of them.
+    """
+
+    def __init__(self, attributes: List[str], types: dict, ref_ids: dict):
+        """Constructs a new FrameBuilder.
+        Args:
+        attributes -- the names of the columns
+        types -- maps the attribute names to their (Metadata API) type, e.g. 'int' or 'xref'
+        ref_ids -- maps the reference attributes to the idAttribute of the entity type they refer to
+        """
+        self._pandas = _import_pandas()
+        self._attributes = attributes
+        self._types = {name: types.get(name, "string").lower() for name in attributes}
+        self._ref_ids = ref_ids
+        self._pages = {name: [] for name in attributes}
+        self._categories = {name: [] for name in attributes if self._types[name] in _CATEGORY_TYPES}
+
+    def add_page(self, rows: List[dict]):
+        """Converts a page of entity rows to typed columns."""
+        for name in self._attributes:
+            values = self._values(name, rows)
+            if name in self._categories:
+                # Categories must be known for all pages before the column is created
+                self._categories[name].extend(values)
+            else:
+                self._pages[name].append(self._to_series(name, values))
+
+    def build(self):
+        """Returns the DataFrame with the rows of all pages."""
+        pd = self._pandas
+        columns = {}
+        for name in self._attributes:
+            if name in self._categories:
+                columns[name] = pd.Series(self._categories[name], dtype="category")
+            elif self._pages[name]:
+                columns[name] = pd.concat(self._pages[name], ignore_index=True)
+            else:
+                columns[name] = self._to_series(name, [])
+        return pd.DataFrame(columns, columns=self._attributes)
+
+    def _values(self, name: str, rows: List[dict]) -> list:
+        type_ = self._types[name]
+        if type_ in _REF_TYPES:
+            ref_id = self._ref_ids.get(name)
+            return [_ref_id(row.get(name), ref_id) for row in rows]
+        if type_ in _MREF_TYPES:
+            ref_id = self._ref_ids.get(name)
+            return [[_ref_id(ref, ref_id) for ref in row[name]] if name in row else None for row in rows]
+        return [row.get(name) for row in rows]
+
+    def _to_series(self, name: str, values: Iterable):
+        pd = self._pandas
+        type_ = self._types[name]
+        if type_ in _INTEGER_DTYPES:
+            return pd.Series(values, dtype=_INTEGER_DTYPES[type_])
+        if type_ == "decimal":
+            return pd.Series(values, dtype="float64")
+        if type_ == "bool":
+            return pd.Series(values, dtype="boolean")
+        if type_ == "date":
+            return pd.Series(pd.to_datetime(values, format="%Y-%m-%d"))
+        if type_ == "date_time":
+            return pd.Series(pd.to_datetime(values, utc=True, format="ISO8601"))
+        return pd.Series(values, dtype="object")
+
+
+def _ref_id(value, ref_id: str):
+    if type(value) is dict:
+        return value[ref_id]
+    return value
+
+
+def _import_pandas():
+    try:
+        import pandas
+    except ImportError:
+        raise ImportError("Retrieving DataFrames requires pandas: pip install molgenis-py-client[pandas]")
+    return pandas
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional, Union
+
+
+class Journal:
+    """Checkpoint journal of bulk writes, stored on local disk, to resume a bulk write that was interrupted.
+
+    Every chunk of rows that has been committed is recorded as a JSON line with the operation, the entity type, the
+    index of the chunk, the range of rows it contains, a hash of its content and the result of writing it (e.g. the
+    identifiers of the added rows). Every record is flushed to disk before the write continues. When the write is run
+    again with the same journal, chunks that are recorded with the same content are skipped and their recorded
+    result is used instead.
+
+    Usage:
+
+    >>> session.add_all('Person', persons, journal='persons.journal')
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """Constructs a new Journal, reading the chunks that were recorded in the file before (if it exists).
+        Args:
+        path -- path of the journal file
+        """
+        self._path = Path(path)
+        self._lock = threading.Lock()
+        self._entries = {}
+        if self._path.exists():
+            with open(self._path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # The last line is incomplete when the process died while writing it
+                    self._entries[(entry["operation"], entry["entity"], entry["chunk"])] = entry
+
+    @property
+    def path(self) -> Path:
+        """The path of the journal file."""
+        return self._path
+
+    def get(self, operation: str, entity: str, chunk: int, hash_: str) -> Optional[dict]:
+        """Returns the record of a chunk when it has been committed with the same content hash, otherwise None."""
+        entry = self._entries.get((operation, entity, chunk))
+        if entry is not None and entry["hash"] == hash_:
+            return entry
+        return None
+
+    def record(self,
+               operation: str,
+               entity: str,
+               chunk: int,
+               hash_: str,
+               result: Any = None,
+               start: int = None,
+               end: int = None):
+        """Records that a chunk of rows has been committed, and flushes the record to disk.
+
+        Args:
+        operation -- the name of the bulk write, e.g. 'add_all'
+        entity -- fully qualified name of the entity (or entities)
+        chunk -- the index of the chunk within the bulk write
+        hash_ -- the content_hash of the rows in the chunk, computed before writing them
+        result -- the (JSON serializable) result of writing the chunk, returned by a rerun instead of writing it again
+        start -- the index of the first row of the chunk in the input, if the chunk is a range of rows
+        end -- the index after the last row of the chunk in the input
+        """
+        entry = {"operation": operation,
+                 "entity": entity,
+                 "chunk": chunk,
+                 "start": start,
+                 "end": end,
+                 "hash": hash_,
+                 "result": result}
+        with self._lock:
+            with open(self._path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            self._entries[(operation, entity, chunk)] = entry
+
+
+def open_journal(journal: Union[str, Path, Journal, None]) -> Optional[Journal]:
+    """Returns the Journal for a journal argument, which is a Journal, a path of a journal file or None."""
+    if journal is None or isinstance(journal, Journal):
+        return journal
+    return Journal(journal)
+
+
+def content_hash(rows: Any) -> str:
+    """Returns a stable hash of the content of a chunk of rows."""
+    return hashlib.sha1(json.dumps(rows, sort_keys=True, default=str).encode("utf-8")).hexdigest()
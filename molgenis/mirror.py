@@ -0,0 +1,225 @@
+import json
+import sqlite3
+from typing import List, Optional
+from urllib.parse import quote
+
+import molgenis.utils as utils
+
+_STATE_TABLE = "_molgenis_mirror"
+
+_INTEGER_TYPES = {"int", "long", "bool"}
+_REAL_TYPES = {"decimal"}
+_LIST_TYPES = {"mref", "categorical_mref", "one_to_many"}
+_SKIPPED_TYPES = {"compound"}
+
+
+class SQLiteMirror:
+    """A local SQLite mirror of MOLGENIS entity types that is kept up to date incrementally.
+
+    The first sync of an entity type retrieves all of its rows. Later syncs only retrieve the rows of which the
+    timestamp attribute (an auto-updated DATE_TIME attribute) is greater than or equal to the latest timestamp seen
+    so far. Deleted rows are detected by comparing the number of rows and, only when they differ, the identifiers.
+    Rows are stored in the upload format: references are stored as identifiers, (m)refs as JSON lists.
+
+    Usage:
+
+    >>> session = Session('http://localhost:8080/')
+    >>> session.login('user', 'password')
+    >>> mirror = SQLiteMirror(session, 'mirror.db')
+    >>> mirror.sync('Person')
+    {'changed': 1000, 'deleted': 0}
+    >>> mirror.create_index('Person', 'city')
+    >>> mirror.get('Person', where='"city" = ?', parameters=['Groningen'])
+    """
+
+    def __init__(self, session, path: str, timestamp_attribute: str = "updatedAt", batch_size: int = 10000):
+        """Constructs a new SQLiteMirror.
+        Args:
+        session -- the Session to retrieve the rows with
+        path -- path of the SQLite database file, use ':memory:' for a mirror that is not stored on disk
+        timestamp_attribute -- the default attribute holding the time a row was last changed
+        batch_size -- the amount of entity rows to retrieve per request (max. 10.000)
+        """
+        self._session = session
+        self._timestamp_attribute = timestamp_attribute
+        self._batch_size = batch_size
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS {} (entity TEXT PRIMARY KEY, id_attribute TEXT, timestamp_attribute TEXT, "
+            "last_timestamp TEXT, columns TEXT)".format(_STATE_TABLE))
+        self._connection.commit()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The connection to the SQLite database, for reads that need more than get() offers."""
+        return self._connection
+
+    @property
+    def entities(self) -> List[str]:
+        """The entity types in this mirror."""
+        return [row[0] for row in self._connection.execute("SELECT entity FROM {}".format(_STATE_TABLE))]
+
+    def sync(self, entity: str, timestamp_attribute: str = None) -> dict:
+        """Brings the mirror of an entity type up to date, adding it to the mirror if it isn't in it yet.
+
+        Args:
+        entity -- fully qualified name of the entity
+        timestamp_attribute -- the attribute holding the time a row was last changed, defaults to the
+            timestamp_attribute of this mirror. Only used when the entity is added to the mirror.
+
+        Returns a dict with the number of changed (added or updated) and deleted rows.
+        """
+        state = self._get_state(entity)
+        new = state is None
+        if new:
+            state = self._new_state(entity, timestamp_attribute or self._timestamp_attribute)
+        q = None
+        if state["last_timestamp"] is not None:
+            q = "{}=ge={}".format(state["timestamp_attribute"], quote(state["last_timestamp"], safe=""))
+        # Without a timestamp (e.g. the entity type had no rows yet), all rows are retrieved
+
+        rows = self._session.get(entity, q=q, batch_size=self._batch_size, uploadable=True)
+        # Use the timestamps of the server, so that the clock of the client doesn't matter
+        timestamps = [row[state["timestamp_attribute"]] for row in rows
+                      if row.get(state["timestamp_attribute"]) is not None]
+        last_timestamp = max([state["last_timestamp"] or ""] + timestamps) or None
+
+        # A new entity type is added in the same transaction as its rows, so a failed first sync leaves nothing behind
+        with self._connection:
+            if new:
+                self._create_table(entity, state)
+            self._upsert_rows(entity, state, rows)
+            deleted = self._delete_removed_rows(entity, state)
+            self._connection.execute("UPDATE {} SET last_timestamp = ? WHERE entity = ?".format(_STATE_TABLE),
+                                     (last_timestamp, entity))
+        return {"changed": len(rows), "deleted": deleted}
+
+    def sync_all(self) -> dict:
+        """Brings the mirrors of all entity types in this mirror up to date. Returns the sync results per entity."""
+        return {entity: self.sync(entity) for entity in self.entities}
+
+    def get(self, entity: str, where: str = None, parameters: tuple = (), order_by: str = None) -> List[dict]:
+        """Reads rows of an entity type from the mirror.
+
+        Args:
+        entity -- fully qualified name of the entity
+        where -- an SQL condition on the (quoted) attribute names, with ? placeholders for parameters
+        parameters -- the values for the placeholders in where
+        order_by -- an SQL ordering on the (quoted) attribute names
+
+        Examples:
+        >>> mirror.get('Person', where='"age" > ? AND "city" = ?', parameters=(18, 'Groningen'), order_by='"age"')
+        """
+        state = self._get_state(entity)
+        if state is None:
+            raise ValueError("Entity type '{}' is not in the mirror".format(entity))
+        sql = "SELECT * FROM {}".format(_quote(entity))
+        if where:
+            sql += " WHERE " + where
+        if order_by:
+            sql += " ORDER BY " + order_by
+        cursor = self._connection.execute(sql, parameters)
+        names = [description[0] for description in cursor.description]
+        return [_to_row(names, values, state["columns"]) for values in cursor]
+
+    def get_by_id(self, entity: str, id_) -> Optional[dict]:
+        """Reads a single row of an entity type from the mirror, returns None if it doesn't exist."""
+        state = self._get_state(entity)
+        rows = self.get(entity, where="{} = ?".format(_quote(state["id_attribute"])), parameters=(id_,))
+        return rows[0] if rows else None
+
+    def create_index(self, entity: str, attribute: str):
+        """Creates an index on an attribute of an entity type in the mirror to speed up reads filtering on it."""
+        self._connection.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(
+            _quote("{}_{}_idx".format(entity, attribute)), _quote(entity), _quote(attribute)))
+        self._connection.commit()
+
+    def close(self):
+        """Closes the connection to the SQLite database."""
+        self._connection.close()
+
+    def _get_state(self, entity: str) -> Optional[dict]:
+        row = self._connection.execute(
+            "SELECT id_attribute, timestamp_attribute, last_timestamp, columns FROM {} WHERE entity = ?".format(
+                _STATE_TABLE), (entity,)).fetchone()
+        if row is None:
+            return None
+        return {"id_attribute": row[0], "timestamp_attribute": row[1], "last_timestamp": row[2],
+                "columns": json.loads(row[3])}
+
+    def _new_state(self, entity: str, timestamp_attribute: str) -> dict:
+        meta = self._session.get_meta(entity, abstract=True)
+        id_attribute = utils.get_id_attribute(meta)
+        columns = {attr["data"]["name"]: attr["data"]["type"].lower() for attr in meta["attributes"]["items"]
+                   if attr["data"]["type"].lower() not in _SKIPPED_TYPES}
+        if timestamp_attribute not in columns:
+            raise ValueError("Entity type '{}' has no timestamp attribute '{}'".format(entity, timestamp_attribute))
+
+        return {"id_attribute": id_attribute, "timestamp_attribute": timestamp_attribute, "last_timestamp": None,
+                "columns": columns}
+
+    def _create_table(self, entity: str, state: dict):
+        # The INSERT starts the transaction, so that the CREATE TABLE is rolled back with it
+        self._connection.execute(
+            "INSERT INTO {} (entity, id_attribute, timestamp_attribute, columns) VALUES (?, ?, ?, ?)".format(
+                _STATE_TABLE), (entity, state["id_attribute"], state["timestamp_attribute"],
+                                json.dumps(state["columns"])))
+        definitions = ["{} {}{}".format(_quote(name), _sqlite_type(type_),
+                                        " PRIMARY KEY" if name == state["id_attribute"] else "")
+                       for name, type_ in state["columns"].items()]
+        self._connection.execute("CREATE TABLE {} ({})".format(_quote(entity), ", ".join(definitions)))
+
+    def _upsert_rows(self, entity: str, state: dict, rows: List[dict]):
+        names = list(state["columns"])
+        sql = "INSERT OR REPLACE INTO {} ({}) VALUES ({})".format(
+            _quote(entity), ", ".join(_quote(name) for name in names), ", ".join("?" for _ in names))
+        self._connection.executemany(sql, [[_to_sqlite(row.get(name), state["columns"][name]) for name in names]
+                                           for row in rows])
+
+    def _delete_removed_rows(self, entity: str, state: dict) -> int:
+        local_count = self._connection.execute("SELECT COUNT(*) FROM {}".format(_quote(entity))).fetchone()[0]
+        if local_count == self._session.count(entity):
+            # All rows on the server are in the mirror, so equal counts mean that nothing was deleted
+            return 0
+
+        id_attribute = state["id_attribute"]
+        ids = self._session.get(entity, attributes=id_attribute, batch_size=self._batch_size)
+        self._connection.execute("CREATE TEMP TABLE IF NOT EXISTS _molgenis_ids (id PRIMARY KEY)")
+        self._connection.execute("DELETE FROM _molgenis_ids")
+        self._connection.executemany("INSERT OR IGNORE INTO _molgenis_ids VALUES (?)",
+                                     [(row[id_attribute],) for row in ids])
+        cursor = self._connection.execute("DELETE FROM {} WHERE {} NOT IN (SELECT id FROM _molgenis_ids)".format(
+            _quote(entity), _quote(id_attribute)))
+        return cursor.rowcount
+
+
+def _quote(identifier: str) -> str:
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+def _sqlite_type(type_: str) -> str:
+    if type_ in _INTEGER_TYPES:
+        return "INTEGER"
+    if type_ in _REAL_TYPES:
+        return "REAL"
+    return "TEXT"
+
+
+def _to_sqlite(value, type_: str):
+    if value is not None and type_ in _LIST_TYPES:
+        return json.dumps(value)
+    return value
+
+
+def _to_row(names: List[str], values: tuple, columns: dict) -> dict:
+    row = {}
+    for name, value in zip(names, values):
+        if value is None:
+            continue
+        type_ = columns.get(name)
+        if type_ in _LIST_TYPES:
+            value = json.loads(value)
+        elif type_ == "bool":
+            value = bool(value)
+        row[name] = value
+    return row
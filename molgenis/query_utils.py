@@ -13,6 +13,8 @@ def build_api_url(base_url: str, possible_options: dict):
             operator = process_sort(option_value)
         elif option == 'attrs':
             operator = merge_attrs(option_value)
+        elif option == 'num' and option_value == 0:
+            operator = 'num=0'
         elif option_value and not (option == 'num' and option_value == 100):
             operator = '{}={}'.format(option, option_value)
 
@@ -47,18 +49,24 @@ def split_if_not_none(operator: Optional[str]) -> List[str]:
     return operator.split(',') if operator else []
 
 
-def merge_attrs(attr_expands: List[Optional[str]]) -> str:
-    """Converts the attrs and expands to an attr attribute compatible with the REST API v2"""
+def merge_attrs(attr_expands: list) -> str:
+    """Converts the attrs and expands to an attr attribute compatible with the REST API v2. An optional third item
+    maps (reference) attributes to the sub-selection of attributes to retrieve for them."""
     # Make a list of attrs and expands
     attrs = split_if_not_none(attr_expands[0])
     expands = split_if_not_none(attr_expands[1])
-    # If only expands is specified, all attributes should be returned, so add a wildcard to the list
-    if len(attrs) == 0 and len(expands) > 0:
+    projections = attr_expands[2] if len(attr_expands) > 2 and attr_expands[2] else {}
+    # If only expands or projections are specified, all attributes should be returned, so add a wildcard to the list
+    if len(attrs) == 0 and (len(expands) > 0 or len(projections) > 0):
         attrs.append('*')
     # Get a set of all unique attributes (expands and attributes merged)
     unique_attrs = set(attrs + expands)
+    # The wildcard selects all attributes, so all of them get their sub-selection
+    if '*' in unique_attrs:
+        unique_attrs.update(projections)
     # Iterate over all unique attributes and expand by adding (*) if the attributes is in the expands list
-    attrs_operator = [attr + '(*)' if attr in expands else attr for attr in unique_attrs]
+    attrs_operator = [attr + '({})'.format(projections[attr]) if attr in projections
+                      else attr + '(*)' if attr in expands else attr for attr in unique_attrs]
     # If there is an attrs operator, return it with its prefix and comma separated
     if attrs_operator:
         return 'attrs={}'.format(','.join(attrs_operator))
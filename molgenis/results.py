@@ -0,0 +1,200 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+from typing import Iterable, Iterator, List
+
+_MISSING = object()
+_NON_DATA_FIELDS = ("_href", "_meta")
+
+
+class RowView(Mapping):
+    """Read-only dict-like view on a row of CompactRows."""
+
+    __slots__ = ("_index", "_values")
+
+    def __init__(self, index: dict, values: tuple):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        position = self._index[key]
+        value = self._values[position] if position < len(self._values) else _MISSING
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        values = self._values
+        return (name for name, position in self._index.items()
+                if position < len(values) and values[position] is not _MISSING)
+
+    def __len__(self) -> int:
+        return sum(1 for value in self._values if value is not _MISSING)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class CompactRows(Sequence):
+    """Memory efficient list of entity rows. Every row is stored as a tuple of values, with the attribute names
+    stored once in a schema that is shared by all rows. Non-data fields (_href and _meta) are dropped. Accessing a
+    row returns a RowView, which behaves like a read-only dict.
+
+    >>> rows = CompactRows(['id', 'name'])
+    >>> rows.extend([{'_href': '/api/v2/Person/1', 'id': '1', 'name': 'Jan'}])
+    >>> rows[0]['name']
+    'Jan'
+    >>> dict(rows[0])
+    {'id': '1', 'name': 'Jan'}
+    """
+
+    def __init__(self, attributes: Iterable[str] = ()):
+        self._index = {}
+        self._rows = []
+        for attribute in attributes:
+            self._add_attribute(attribute)
+
+    @property
+    def attributes(self) -> List[str]:
+        """The names of the attributes in the schema of the rows."""
+        return list(self._index)
+
+    def extend(self, rows: Iterable[dict]):
+        """Adds entity rows, which are converted to tuples following the schema."""
+        for row in rows:
+            for name in row:
+                if name not in self._index and name not in _NON_DATA_FIELDS:
+                    self._add_attribute(name)
+            self._rows.append(tuple([row.get(name, _MISSING) for name in self._index]))
+
+    def to_dicts(self) -> List[dict]:
+        """Converts the rows to a list of plain dicts."""
+        return [dict(row) for row in self]
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            rows = CompactRows()
+            rows._index = dict(self._index)
+            rows._rows = self._rows[item]
+            return rows
+        return RowView(self._index, self._rows[item])
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __repr__(self) -> str:
+        return "CompactRows({} rows, attributes={})".format(len(self), self.attributes)
+
+    def _add_attribute(self, name: str):
+        # Rows added before are shorter than the new schema, RowView treats their missing positions as missing values
+        self._index[name] = len(self._index)
+
+
+class SpilledRows(Sequence):
+    """List of entity rows that is stored in a temporary SQLite database on disk instead of in memory, for results
+    that don't fit in memory. The rows are stored in pages, of which only the cache_pages most recently used pages
+    are kept in memory. Accessing a row returns a dict; changing it doesn't change the stored row. A slice returns a
+    plain list of rows.
+
+    The database file is removed by close(), at the end of a with block, or when the SpilledRows is garbage collected.
+
+    >>> with session.get('Person', spill=True) as rows:
+    ...     print(len(rows), rows[-1]['name'])
+    """
+
+    def __init__(self, page_size: int = 1000, cache_pages: int = 8, directory: str = None):
+        """Constructs a new, empty SpilledRows.
+        Args:
+        page_size -- the number of rows per page
+        cache_pages -- the maximum number of decoded pages kept in memory
+        directory -- the directory of the database file, the default temporary directory when None
+        """
+        self._page_size = page_size
+        self._cache_pages = cache_pages
+        self._cache = OrderedDict()
+        self._tail = []
+        self._length = 0
+        self._lock = threading.Lock()
+        descriptor, self._path = tempfile.mkstemp(prefix="molgenis-", suffix=".sqlite", dir=directory)
+        os.close(descriptor)
+        self._connection = sqlite3.connect(self._path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode = OFF")
+        self._connection.execute("PRAGMA synchronous = OFF")
+        self._connection.execute("CREATE TABLE pages (number INTEGER PRIMARY KEY, rows BLOB NOT NULL)")
+        self._finalizer = weakref.finalize(self, _remove_database, self._connection, self._path)
+
+    def extend(self, rows: Iterable[dict]):
+        """Adds entity rows, writing every full page to disk."""
+        with self._lock:
+            for row in rows:
+                self._tail.append(row)
+                self._length += 1
+                if len(self._tail) == self._page_size:
+                    self._store_tail()
+            self._connection.commit()
+
+    def close(self):
+        """Removes the database file. The rows can't be accessed anymore."""
+        with self._lock:
+            self._cache.clear()
+            self._tail = []
+            self._length = 0
+            self._finalizer()
+
+    def __enter__(self) -> "SpilledRows":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[index] for index in range(*item.indices(len(self)))]
+        index = item + len(self) if item < 0 else item
+        if not 0 <= index < len(self):
+            raise IndexError("row index out of range")
+        return dict(self._page(index // self._page_size)[index % self._page_size])
+
+    def __iter__(self) -> Iterator[dict]:
+        for number in range((len(self) + self._page_size - 1) // self._page_size):
+            yield from (dict(row) for row in self._page(number))
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __repr__(self) -> str:
+        return "SpilledRows({} rows, path={})".format(len(self), self._path)
+
+    def _store_tail(self):
+        number = (self._length - 1) // self._page_size
+        self._connection.execute("INSERT INTO pages (number, rows) VALUES (?, ?)",
+                                 (number, pickle.dumps(self._tail, pickle.HIGHEST_PROTOCOL)))
+        self._tail = []
+
+    def _page(self, number: int) -> List[dict]:
+        with self._lock:
+            if number == self._length // self._page_size:
+                return self._tail  # The last page is not full yet and still in memory
+            page = self._cache.get(number)
+            if page is not None:
+                self._cache.move_to_end(number)
+                return page
+            blob, = self._connection.execute("SELECT rows FROM pages WHERE number = ?", (number,)).fetchone()
+            page = pickle.loads(blob)
+            self._cache[number] = page
+            if len(self._cache) > self._cache_pages:
+                self._cache.popitem(last=False)
+            return page
+
+
+def _remove_database(connection: sqlite3.Connection, path: str):
+    connection.close()
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,323 @@
+import re
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from typing import Any, Callable, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+_OPERATOR = re.compile(r"==|!=|<=|>=|<|>|=[a-z]+=")
+_SELECTOR = re.compile(r"[^=!<>;,()\s\"']+")
+_UNQUOTED = re.compile(r"[^;,()\s\"']+")
+_QUOTED = re.compile(r"\"((?:[^\"\\]|\\.)*)\"|'((?:[^'\\]|\\.)*)'")
+_ALIASES = {"<": "=lt=", "<=": "=le=", ">": "=gt=", ">=": "=ge="}
+_OPERATORS = {"==", "!=", "=q=", "=sq=", "=like=", "=notlike=", "=in=", "=out=", "=lt=", "=le=", "=gt=", "=ge=",
+              "=rng="}
+_NUMBER_TYPES = {"int", "long", "decimal"}
+_RANGE_OPERATORS = {"=lt=", "=le=", "=gt=", "=ge=", "=rng="}
+
+
+class Comparison(NamedTuple):
+    """A comparison in an RSQL query, e.g. age=gt=18"""
+    selector: str
+    operator: str
+    arguments: Tuple[str, ...]
+
+
+class And(NamedTuple):
+    """Constraints that must all hold, separated by ; or and"""
+    children: Tuple["Node", ...]
+
+
+class Or(NamedTuple):
+    """Constraints of which one must hold, separated by , or or"""
+    children: Tuple["Node", ...]
+
+
+Node = Union[Comparison, And, Or]
+
+
+@lru_cache(maxsize=1024)
+def parse(q: str) -> Node:
+    """Parses a query in the RSQL syntax accepted by the q parameter of Session.get. Raises a ValueError when the
+    query is invalid.
+
+    >>> parse('age=gt=18')
+    Comparison(selector='age', operator='=gt=', arguments=('18',))
+    >>> parse('name=in=(Jan,Piet) or age==""')
+    Or(children=(Comparison(selector='name', operator='=in=', arguments=('Jan', 'Piet')), \
+Comparison(selector='age', operator='==', arguments=('',))))
+    """
+    return _Parser(q).parse()
+
+
+class _Parser:
+
+    def __init__(self, q: str):
+        self._q = q
+        self._position = 0
+
+    def parse(self) -> Node:
+        node = self._or()
+        self._skip_whitespace()
+        if self._position != len(self._q):
+            self._error("unexpected '{}'".format(self._q[self._position]))
+        return node
+
+    def _or(self) -> Node:
+        children = [self._and()]
+        while self._accept(",", "or"):
+            children.append(self._and())
+        return children[0] if len(children) == 1 else Or(tuple(children))
+
+    def _and(self) -> Node:
+        children = [self._constraint()]
+        while self._accept(";", "and"):
+            children.append(self._constraint())
+        return children[0] if len(children) == 1 else And(tuple(children))
+
+    def _constraint(self) -> Node:
+        self._skip_whitespace()
+        if self._accept("("):
+            node = self._or()
+            self._expect(")")
+            return node
+        selector = self._match(_SELECTOR, "attribute")
+        operator = self._match(_OPERATOR, "operator")
+        operator = _ALIASES.get(operator, operator)
+        if operator not in _OPERATORS:
+            self._error("unknown operator '{}'".format(operator))
+        if self._accept("("):
+            arguments = [self._argument()]
+            while self._accept(","):
+                arguments.append(self._argument())
+            self._expect(")")
+        else:
+            arguments = [self._argument()]
+        return Comparison(selector, operator, tuple(arguments))
+
+    def _argument(self) -> str:
+        self._skip_whitespace()
+        match = _QUOTED.match(self._q, self._position)
+        if match:
+            self._position = match.end()
+            quoted = match.group(1) if match.group(1) is not None else match.group(2)
+            return re.sub(r"\\(.)", r"\1", quoted)
+        match = _UNQUOTED.match(self._q, self._position)
+        if match:
+            self._position = match.end()
+            return match.group()
+        return ""
+
+    def _accept(self, symbol: str, keyword: str = None) -> bool:
+        self._skip_whitespace()
+        if self._q.startswith(symbol, self._position):
+            self._position += len(symbol)
+            return True
+        if keyword and re.match(keyword + r"\s", self._q[self._position:]) and self._q[self._position - 1].isspace():
+            self._position += len(keyword)
+            return True
+        return False
+
+    def _expect(self, symbol: str):
+        if not self._accept(symbol):
+            self._error("expected '{}'".format(symbol))
+
+    def _match(self, pattern, name: str) -> str:
+        match = pattern.match(self._q, self._position)
+        if not match:
+            self._error("expected {}".format(name))
+        self._position = match.end()
+        return match.group()
+
+    def _skip_whitespace(self):
+        while self._position < len(self._q) and self._q[self._position].isspace():
+            self._position += 1
+
+    def _error(self, message: str):
+        raise ValueError("Invalid RSQL query '{}' at position {}: {}".format(self._q, self._position, message))
+
+
+class LocalTable:
+    """Rows of an entity type held in memory, that can be queried with the RSQL syntax of the q parameter of
+    Session.get without a round trip to the server. Equality (==, =in=) and range (=lt=, =ge=, =rng=, ...)
+    constraints on indexed attributes are looked up in a hash or sorted index, other constraints are evaluated
+    row by row.
+
+    Values are compared as numbers, booleans or strings, depending on the type of the attribute. References are
+    compared by identifier, mrefs match when one of their identifiers matches. An empty argument matches missing
+    values, e.g. 'mother==""'.
+
+    Usage:
+
+    >>> table = session.get_local_table('Person', indexes=['city', 'age'])
+    >>> table.get('city==Groningen;age=ge=18')
+    """
+
+    def __init__(self, rows: Iterable[dict], types: dict = None, indexes: Iterable[str] = ()):
+        """Constructs a new LocalTable.
+        Args:
+        rows -- the rows, in upload format
+        types -- maps the attribute names to their (Metadata API) type, e.g. 'int' or 'xref'. When missing, the type
+            is derived from the values
+        indexes -- the attributes to index
+        """
+        self._rows = list(rows)
+        self._types = {name: type_.lower() for name, type_ in (types or {}).items()}
+        self._hash_indexes = {}
+        self._sorted_indexes = {}
+        for attribute in indexes:
+            self.create_index(attribute)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def create_index(self, attribute: str):
+        """Indexes the values of an attribute, to look up equality and range constraints on it."""
+        normalize = self._normalizer(attribute)
+        hash_index = {}
+        for position, row in enumerate(self._rows):
+            for value in _values(row, attribute, normalize):
+                hash_index.setdefault(value, []).append(position)
+        self._hash_indexes[attribute] = hash_index
+        try:
+            entries = sorted((value, position) for value, positions in hash_index.items() for position in positions)
+            self._sorted_indexes[attribute] = ([value for value, _ in entries], [position for _, position in entries])
+        except TypeError:
+            pass  # Values of different types can't be sorted
+
+    def get(self, q: str = None) -> List[dict]:
+        """Returns the rows that match an RSQL query, in their original order. The rows are not copied."""
+        if not q:
+            return list(self._rows)
+        node = parse(q)
+        predicate = self._compile(node)
+        candidates = self._candidates(node)
+        positions = sorted(candidates) if candidates is not None else range(len(self._rows))
+        return [self._rows[position] for position in positions if predicate(self._rows[position])]
+
+    def _candidates(self, node: Node) -> Optional[set]:
+        """Returns the positions of the rows that may match according to the indexes, or None when all may match."""
+        if isinstance(node, And):
+            # All rows are checked against the complete query, so the smallest set of candidates suffices. Equality
+            # lookups are cheap, ranges may contain most rows and are only used when there are no equality lookups.
+            children = sorted(node.children, key=lambda child: isinstance(child, Comparison) and
+                              child.operator in _RANGE_OPERATORS)
+            for child in children:
+                candidates = self._candidates(child)
+                if candidates is not None:
+                    return candidates
+            return None
+        if isinstance(node, Or):
+            candidates = [self._candidates(child) for child in node.children]
+            return None if None in candidates else set.union(*candidates)
+        if node.operator in ("==", "=in=") and node.selector in self._hash_indexes and "" not in node.arguments:
+            index = self._hash_indexes[node.selector]
+            arguments = self._coerce(node.selector, node.arguments)
+            return {position for argument in arguments for position in index.get(argument, ())}
+        if node.operator in _RANGE_OPERATORS and node.selector in self._sorted_indexes:
+            return self._range(node)
+        return None
+
+    def _range(self, node: Comparison) -> Optional[set]:
+        values, positions = self._sorted_indexes[node.selector]
+        arguments = self._coerce(node.selector, node.arguments)
+        try:
+            if node.operator == "=rng=":
+                start, end = bisect_left(values, arguments[0]), bisect_right(values, arguments[1])
+            elif node.operator in ("=lt=", "=le="):
+                start = 0
+                end = (bisect_left if node.operator == "=lt=" else bisect_right)(values, arguments[0])
+            else:
+                start = (bisect_right if node.operator == "=gt=" else bisect_left)(values, arguments[0])
+                end = len(values)
+        except TypeError:
+            return None  # The argument can't be compared with the values
+        return set(positions[start:end])
+
+    def _compile(self, node: Node) -> Callable[[dict], bool]:
+        if isinstance(node, And):
+            predicates = [self._compile(child) for child in node.children]
+            return lambda row: all(predicate(row) for predicate in predicates)
+        if isinstance(node, Or):
+            predicates = [self._compile(child) for child in node.children]
+            return lambda row: any(predicate(row) for predicate in predicates)
+
+        selector, operator = node.selector, node.operator
+        normalize = self._normalizer(selector)
+        if operator in ("==", "!=", "=in=", "=out="):
+            if node.arguments == ("",):
+                matches = lambda row: not _values(row, selector, normalize)
+            else:
+                arguments = set(self._coerce(selector, node.arguments))
+                matches = lambda row: any(value in arguments for value in _values(row, selector, normalize))
+            return matches if operator in ("==", "=in=") else lambda row: not matches(row)
+        if operator in ("=like=", "=notlike=", "=q=", "=sq="):
+            text = node.arguments[0].lower()
+            matches = lambda row: any(text in str(value).lower() for value in _values(row, selector, normalize))
+            return matches if operator != "=notlike=" else lambda row: not matches(row)
+
+        arguments = self._coerce(selector, node.arguments)
+        compare = {"=lt=": lambda value: value < arguments[0],
+                   "=le=": lambda value: value <= arguments[0],
+                   "=gt=": lambda value: value > arguments[0],
+                   "=ge=": lambda value: value >= arguments[0],
+                   "=rng=": lambda value: arguments[0] <= value <= arguments[1]}[operator]
+        return lambda row: any(_compare(compare, value) for value in _values(row, selector, normalize))
+
+    def _coerce(self, attribute: str, arguments: Tuple[str, ...]) -> List[Any]:
+        kind = self._kind(attribute)
+        try:
+            if kind == "number":
+                return [float(argument) for argument in arguments]
+            if kind == "bool":
+                return [argument.lower() == "true" for argument in arguments]
+        except ValueError:
+            raise ValueError("Invalid value for attribute '{}': {}".format(attribute, ", ".join(arguments)))
+        return list(arguments)
+
+    def _normalizer(self, attribute: str) -> Callable[[Any], Any]:
+        kind = self._kind(attribute)
+        if kind == "number":
+            return _to_number
+        if kind == "bool":
+            return lambda value: value if isinstance(value, bool) else str(value).lower() == "true"
+        return str
+
+    def _kind(self, attribute: str) -> str:
+        type_ = self._types.get(attribute)
+        if type_ is None:
+            # Derive the kind from the first value
+            for row in self._rows:
+                values = _values(row, attribute, lambda value: value)
+                if values:
+                    type_ = "bool" if isinstance(values[0], bool) else \
+                        "decimal" if isinstance(values[0], (int, float)) else "string"
+                    break
+            self._types[attribute] = type_ = type_ or "string"
+        if type_ in _NUMBER_TYPES:
+            return "number"
+        return "bool" if type_ == "bool" else "string"
+
+
+def _values(row: dict, selector: str, normalize: Callable[[Any], Any]) -> list:
+    """Returns the normalized values of an attribute of a row, as a list to handle mrefs and missing values alike."""
+    value = row
+    for name in selector.split("."):
+        value = value.get(name) if isinstance(value, dict) else None
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return [normalize(item) for item in value if item is not None]
+    return [normalize(value)]
+
+
+def _to_number(value: Any) -> Any:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _compare(compare: Callable[[Any], bool], value: Any) -> bool:
+    try:
+        return compare(value)
+    except TypeError:
+        return False
@@ -1,7 +1,15 @@
-from typing import List
+from typing import Any, Dict, Iterable, List, Optional, Set
 
 import copy
 import csv
+import datetime
+import hashlib
+import json
+from decimal import Decimal, InvalidOperation
+
+from molgenis.converters import json_default, to_datetime
+
+_NUMBER_TYPES = {"int", "long", "decimal"}
 
 
 def create_csv(table: List[dict], file_name: str, meta_attributes: List[str]):
@@ -26,17 +34,169 @@ def merge_two_dicts(x: dict, y: dict) -> dict:
 
 def remove_one_to_manys(rows: List[dict], meta: dict) -> List[dict]:
     """
-    Removes all one-to-manys from a list of rows based on the table's metadata. Removing
-    one-to-manys is necessary when adding new rows. Returns a copy so that the original
-    rows are not changed in any way.
+    Removes all one-to-manys from a list of rows based on the table's metadata (retrieved with
+    the REST API v1 or the Metadata API). Removing one-to-manys is necessary when adding new
+    rows. Returns a copy so that the original rows are not changed in any way.
     """
     one_to_manys = []
-    for attribute in meta["attributes"].keys():
-        if meta["attributes"][attribute]["fieldType"] == "ONE_TO_MANY":
-            print(attribute)
-            one_to_manys.append(attribute)
+    if "items" in meta["attributes"]:  # Metadata API
+        one_to_manys = [attribute["data"]["name"] for attribute in meta["attributes"]["items"]
+                        if attribute["data"]["type"].lower() == "one_to_many"]
+    else:  # REST API v1
+        for attribute in meta["attributes"].keys():
+            if meta["attributes"][attribute]["fieldType"] == "ONE_TO_MANY":
+                print(attribute)
+                one_to_manys.append(attribute)
     copied_rows = copy.deepcopy(rows)
     for row in copied_rows:
         for one_to_many in one_to_manys:
             row.pop(one_to_many, None)
     return copied_rows
+
+
+def get_attribute(meta: dict, name: str) -> dict:
+    """Returns the data of the attribute with the given name from metadata retrieved with the Metadata API."""
+    for attribute in meta["attributes"]["items"]:
+        if attribute["data"]["name"] == name:
+            return attribute["data"]
+    raise KeyError("Unknown attribute '{}' of entity type '{}'".format(name, meta["id"]))
+
+
+def get_id_attribute(meta: dict) -> str:
+    """Returns the name of the idAttribute from metadata retrieved with the Metadata API."""
+    for attribute in meta["attributes"]["items"]:
+        if attribute["data"].get("idAttribute") is True:
+            return attribute["data"]["name"]
+
+
+def get_attribute_types(meta: dict) -> Dict[str, str]:
+    """Maps the names of the attributes to their (lower case) types, from metadata retrieved with the Metadata API."""
+    return {attribute["data"]["name"]: attribute["data"]["type"].lower() for attribute in meta["attributes"]["items"]}
+
+
+def get_ref_entity_type_id(attribute: dict) -> Optional[str]:
+    """Returns the id of the entity type an attribute refers to, or None if it is not a reference attribute."""
+    if "refEntityType" not in attribute:
+        return None
+    ref_url = attribute["refEntityType"]["self"]
+    return ref_url[ref_url.rindex("/"):].replace("/", "")
+
+
+def to_upload_format(rows: List[dict], ref_ids: dict) -> List[dict]:
+    """
+    Changes rows retrieved with the REST API v2 in place such that they can be uploaded again:
+    1. Non-data fields are removed (_href and _meta).
+    2. Reference objects are removed and replaced with their identifiers.
+    ref_ids maps the reference attributes to the idAttribute of the entity type they refer to.
+    """
+    for row in rows:
+        # Remove non-data fields
+        row.pop("_href", None)
+        row.pop("_meta", None)
+
+        for attr in row:
+            if type(row[attr]) is dict:
+                # Change xref dicts to id
+                row[attr] = row[attr][ref_ids[attr]]
+            elif type(row[attr]) is list and len(row[attr]) > 0:
+                # Change mref list of dicts to list of ids
+                row[attr] = [ref[ref_ids[attr]] for ref in row[attr]]
+    return rows
+
+
+def aggregate_label(label: Any, ref_id_attr: Optional[str]) -> Any:
+    """Returns a hashable representation of an aggregate label: references are replaced by their identifier."""
+    if type(label) is dict and ref_id_attr:
+        return label[ref_id_attr]
+    return label
+
+
+def chunks(rows: list, size: int) -> List[list]:
+    """Splits a list into consecutive lists of at most size items."""
+    return [rows[start:start + size] for start in range(0, len(rows), size)]
+
+
+def row_hash(row: dict, attributes: Iterable[str] = None, types: Dict[str, str] = None) -> str:
+    """
+    Returns a stable hash of the values of a row (in upload format), limited to the given attributes. Values are
+    normalized first, so that e.g. 1998 and "1998", or True and "true", hash the same and a missing value equals None.
+    types maps attribute names to their types (see get_attribute_types). With it, numbers are compared by value (1.5
+    equals "1.50") and dates and datetimes (also as datetime objects) in the format of the server, in UTC.
+    """
+    if attributes is None:
+        attributes = row.keys()
+    types = types or {}
+    values = {attr: _normalize(row.get(attr), types.get(attr)) for attr in attributes}
+    return hashlib.sha1(json.dumps(values, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _normalize(value: Any, type_: str = None) -> Any:
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item, type_) for item in value]
+    try:
+        if type_ in _NUMBER_TYPES:
+            # normalize() strips trailing zeros, so that 1.5, "1.50" and Decimal("1.5") are equal
+            return str(Decimal(str(value)).normalize())
+        if type_ == "date":
+            if isinstance(value, datetime.datetime):
+                value = value.date()
+            return value.isoformat() if isinstance(value, datetime.date) else str(value)
+        if type_ == "date_time":
+            if not isinstance(value, datetime.datetime):
+                value = to_datetime(str(value))
+            if value.tzinfo is not None:
+                value = value.astimezone(datetime.timezone.utc)
+            return json_default(value)
+    except (InvalidOperation, ValueError):
+        # Leave values that can't be parsed to the server to reject
+        pass
+    return str(value)
+
+
+def get_dependencies(metas: Dict[str, dict]) -> Dict[str, Set[str]]:
+    """Maps every entity type to the entity types among the given ones it refers to, including itself when it refers
+    to itself. metas maps the entity type ids to their metadata retrieved with the Metadata API."""
+    return {entity: {get_ref_entity_type_id(attr["data"]) for attr in meta["attributes"]["items"]} & set(metas)
+            for entity, meta in metas.items()}
+
+
+def dependency_groups(dependencies: Dict[str, Set[str]]) -> List[List[str]]:
+    """
+    Groups the nodes that depend on each other circularly (the strongly connected components) and orders the groups
+    such that every group only depends on groups before it. dependencies maps every node to the nodes it depends on,
+    dependencies on unknown nodes are ignored.
+    """
+    # Tarjan's algorithm, which finds a group only after all groups it depends on
+    index = {}
+    low_link = {}
+    stack = []
+    on_stack = set()
+    groups = []
+
+    def visit(node):
+        index[node] = low_link[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+        for dependency in dependencies[node]:
+            if dependency not in dependencies:
+                continue
+            if dependency not in index:
+                visit(dependency)
+                low_link[node] = min(low_link[node], low_link[dependency])
+            elif dependency in on_stack:
+                low_link[node] = min(low_link[node], index[dependency])
+        if low_link[node] == index[node]:
+            group = []
+            while not group or group[-1] != node:
+                group.append(stack.pop())
+                on_stack.discard(group[-1])
+            groups.append(group[::-1])
+
+    for node in dependencies:
+        if node not in index:
+            visit(node)
+    return groups
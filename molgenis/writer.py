@@ -0,0 +1,166 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, List
+
+_MODES = ("add", "update", "upsert")
+
+
+class Writer:
+    """Write-behind buffer for entity rows that are produced one at a time. Rows are collected in batches, which are
+    written in the background with add_all, update_all or upsert when the batch is full or when its oldest row has
+    waited for flush_interval seconds.
+
+    At most max_pending batches are being written or waiting to be written at the same time. When the server falls
+    behind, write() blocks until a batch has been written (backpressure). Batches are written concurrently in 'add'
+    mode and one after the other in 'update' and 'upsert' mode, so that later values of a row win. An error while
+    writing a batch is raised by the next call to write(), flush() or close().
+
+    Usage:
+
+    >>> with session.writer('Person', mode='upsert') as writer:
+    ...     for event in events:
+    ...         writer.write({'id': event.person_id, 'lastSeen': event.time})
+    """
+
+    def __init__(self,
+                 session,
+                 entity: str,
+                 mode: str = "add",
+                 batch_size: int = 1000,
+                 flush_interval: float = 5.0,
+                 max_pending: int = 8):
+        """Constructs a new Writer.
+        Args:
+        session -- the Session to write the rows with
+        entity -- fully qualified name of the entity
+        mode -- 'add', 'update' or 'upsert'
+        batch_size -- the number of rows to write at once (max. 1000 in 'add' and 'update' mode is most efficient)
+        flush_interval -- the maximum number of seconds a row is buffered, None to only write full batches
+        max_pending -- the maximum number of batches being written or waiting to be written
+        """
+        if mode not in _MODES:
+            raise ValueError("Unknown mode '{}', expected one of {}".format(mode, ", ".join(_MODES)))
+        # In upsert mode only the identifiers of the batch are looked up, not all identifiers of the entity type
+        self._write_batch = {"add": session.add_all, "update": session.update_all,
+                             "upsert": session._upsert_batch}[mode]
+        self._entity = entity
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._buffer = []
+        self._buffered_since = None
+        self._pending = []
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=max_pending if mode == "add" else 1)
+        self._lock = threading.Lock()
+        self._submit_lock = threading.Lock()
+        self._error = None
+        self._written = 0
+        self._closed = threading.Event()
+        self._timer = None
+        if flush_interval:
+            self._timer = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._timer.start()
+
+    @property
+    def written(self) -> int:
+        """The number of rows that have been written successfully."""
+        return self._written
+
+    def write(self, row: dict):
+        """Buffers a row, writing the batch in the background when it is full. Blocks when max_pending batches are
+        pending."""
+        self.write_all([row])
+
+    def write_all(self, rows: Iterable[dict]):
+        """Buffers multiple rows, writing the batches in the background when they are full."""
+        self._raise_error()
+        if self._closed.is_set():
+            raise ValueError("Writer for '{}' is closed".format(self._entity))
+        for row in rows:
+            with self._lock:
+                if not self._buffer:
+                    self._buffered_since = time.monotonic()
+                self._buffer.append(row)
+                full = len(self._buffer) >= self._batch_size
+            if full:
+                self._submit_buffer(lambda: len(self._buffer) >= self._batch_size)
+
+    def flush(self):
+        """Writes the buffered rows and waits until all pending batches have been written. Raises the first error
+        that occurred while writing a batch."""
+        self._submit_buffer(lambda: True)
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.result()
+        self._raise_error()
+
+    def close(self):
+        """Flushes the buffered rows and stops the background threads."""
+        if self._closed.is_set():
+            return
+        try:
+            self.flush()
+        finally:
+            self._closed.set()
+            if self._timer:
+                self._timer.join()
+            self._executor.shutdown()
+
+    def __enter__(self) -> "Writer":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.close()
+        except Exception:
+            # Don't hide the exception that ended the with block
+            if exc_type is None:
+                raise
+
+    def _submit_buffer(self, condition: Callable[[], bool]):
+        # Taking and submitting a batch happen under one lock, so batches are submitted in the order of their rows
+        with self._submit_lock:
+            with self._lock:
+                if not self._buffer or not condition():
+                    return
+                batch, self._buffer = self._buffer, []
+                self._buffered_since = None
+            self._slots.acquire()
+            with self._lock:
+                future = self._executor.submit(self._write, batch)
+                self._pending.append(future)
+            future.add_done_callback(self._on_done)
+
+    def _write(self, batch: List[dict]):
+        # The outcome is recorded before the future completes: done callbacks only run after the waiters in flush()
+        # have been woken up
+        try:
+            self._write_batch(self._entity, batch)
+        except Exception as ex:
+            with self._lock:
+                if self._error is None:
+                    self._error = ex
+        else:
+            with self._lock:
+                self._written += len(batch)
+        finally:
+            self._slots.release()
+
+    def _on_done(self, future: Future):
+        with self._lock:
+            self._pending.remove(future)
+
+    def _raise_error(self):
+        with self._lock:
+            error, self._error = self._error, None
+        if error:
+            raise error
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self._flush_interval / 2):
+            self._submit_buffer(self._is_due)
+
+    def _is_due(self) -> bool:
+        return time.monotonic() - self._buffered_since >= self._flush_interval
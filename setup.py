@@ -9,6 +9,8 @@ setup(
     packages=['molgenis'],
     python_requires='>=3.6',
     install_requires=['requests>=2.21.0'],
+    entry_points={'console_scripts': ['molgenis=molgenis.cli:main']},
+    extras_require={'pandas': ['pandas>=2.0'], 'streaming': ['requests-toolbelt>=0.9']},
     test_suite='nose.collector',
     tests_require=['nose']
 )
@@ -0,0 +1,52 @@
+import io
+import unittest
+
+from molgenis import cli
+
+
+class TestCli(unittest.TestCase):
+
+    meta = {"id": "Person", "attributes": {"items": [
+        {"data": {"name": "id", "type": "string"}},
+        {"data": {"name": "friends", "type": "mref"}},
+        {"data": {"name": "details", "type": "compound"}},
+        {"data": {"name": "age", "type": "int"}},
+    ]}}
+
+    def test_parser(self):
+        args = cli._parser().parse_args(['--concurrency', '4', 'import', 'Person', 'persons.csv', '--mode', 'upsert'])
+        self.assertEqual(4, args.concurrency)
+        self.assertEqual('upsert', args.mode)
+        self.assertEqual(cli._import, args.command)
+
+    def test_delete_requires_selection(self):
+        with self.assertRaises(SystemExit):
+            cli._parser().parse_args(['delete', 'Person'])
+
+    def test_csv_round_trip(self):
+        rows = [{'id': '1', 'friends': ['2', '3'], 'age': 30}, {'id': '2', 'friends': []}]
+        file = io.StringIO()
+        cli._row_writer(file, 'persons.csv', self.meta)(rows)
+        self.assertEqual('id,friends,age\r\n1,"2,3",30\r\n2,,\r\n', file.getvalue())
+        file.seek(0)
+        self.assertEqual([{'id': '1', 'friends': ['2', '3'], 'age': '30'}, {'id': '2'}],
+                         list(cli._row_reader(file, 'persons.csv', self.meta)))
+
+    def test_csv_integer_references(self):
+        file = io.StringIO()
+        cli._row_writer(file, 'persons.csv', self.meta)([{'id': '1', 'friends': [2, 3]}])
+        self.assertEqual('id,friends,age\r\n1,"2,3",\r\n', file.getvalue())
+
+    def test_json_lines_round_trip(self):
+        rows = [{'id': '1', 'friends': ['2']}]
+        file = io.StringIO()
+        cli._row_writer(file, 'persons.jsonl', self.meta)(rows)
+        file.seek(0)
+        self.assertEqual(rows, list(cli._row_reader(file, 'persons.jsonl', self.meta)))
+
+    def test_batches(self):
+        self.assertEqual([[1, 2], [3]], list(cli._batches(iter([1, 2, 3]), 2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
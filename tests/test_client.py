@@ -1,9 +1,15 @@
+import datetime
+import importlib.util
 import os
+import pickle
+import tempfile
 import unittest
+from decimal import Decimal
 
 from molgenis.errors import raise_exception
 import molgenis.client as molgenis
 import molgenis.query_utils as query_utils
+import molgenis.utils as utils
 
 
 class ResponseMock:
@@ -80,6 +86,17 @@ class TestStringMethods(unittest.TestCase):
             response.connection.close()
             assert response.status_code == 401
 
+    def test_login_again_when_token_expires(self):
+        s = molgenis.Session(self.api_url)
+        s.login('admin', self.password)
+        expired_token = s._token
+        # Log out the token on the server, without the Session noticing
+        s._request("POST", s._api_url + "v1/logout", headers=s._headers.token_header)
+        s.get(self.user_entity)
+        self.assertNotEqual(expired_token, s._token)
+        self.assertIsNone(pickle.loads(pickle.dumps(s))._credentials)
+        s.logout()
+
     def test_token_session_and_get_MolgenisUser(self):
         token = 'token_session_test'
         admin = self.session.get('sys_sec_User', q='username==admin', attributes='id')
@@ -139,6 +156,14 @@ class TestStringMethods(unittest.TestCase):
         assert session._root_url == 'root/'
         assert session._api_url == 'root/api/'
 
+    def test_pickle_session(self):
+        copy = pickle.loads(pickle.dumps(self.session))
+        self.assertEqual(self.expected_ref_data, copy.get(self.ref_entity))
+
+    def test_map_pages(self):
+        results = list(self.session.map_pages(len, self.ref_entity, batch_size=2))
+        self.assertEqual([2, 2, 1], results)
+
     def test_upload_zip(self):
         self._try_delete('sys_md_EntityType', ['org_molgenis_test_python_sightings'])
         response = self.session.upload_zip('./tests/resources/sightings_test.zip').split('/')
@@ -187,6 +212,18 @@ class TestStringMethods(unittest.TestCase):
         self.assertEqual("label66", item66["label"])
         self.session.delete_list(self.ref_entity, ['ref55', "ref66"])
 
+    def test_import_data_split(self):
+        self._try_delete(self.ref_entity, ['ref55'])
+        data = {self.entity: [], self.ref_entity: [{"value": "ref55", "label": "label55"}]}
+        self.session.import_data(data, molgenis.ImportDataAction.ADD_UPDATE_EXISTING,
+                                 molgenis.ImportMetadataAction.IGNORE, split=True)
+        self.assertEqual("label55", self.session.get_by_id(self.ref_entity, "ref55", "label")["label"])
+        self.session.delete(self.ref_entity, 'ref55')
+
+    def test_dependency_groups(self):
+        groups = utils.dependency_groups({'a': {'b'}, 'b': {'a', 'c'}, 'c': set(), 'd': {'d', 'a', 'unknown'}})
+        self.assertEqual([['c'], ['a', 'b'], ['d']], groups)
+
     def test_delete_row(self):
         self._try_add(self.ref_entity, [{"value": "ref55", "label": "label55"}])
         response = self.session.delete(self.ref_entity, 'ref55')
@@ -216,6 +253,44 @@ class TestStringMethods(unittest.TestCase):
         self.session.delete(self.ref_entity, 'ref55')
         self.session.delete(self.ref_entity, 'ref57')
 
+    def test_add_all_journal(self):
+        self._try_delete(self.ref_entity, ['ref55', 'ref57'])
+        rows = [{"value": "ref55", "label": "label55"}, {"value": "ref57", "label": "label57"}]
+        with tempfile.TemporaryDirectory() as directory:
+            journal = os.path.join(directory, 'add_all.journal')
+            self.assertEqual(['ref55', 'ref57'], self.session.add_all(self.ref_entity, rows, journal=journal))
+            # The rerun skips the committed batch instead of failing on the duplicate identifiers
+            self.assertEqual(['ref55', 'ref57'], self.session.add_all(self.ref_entity, rows, journal=journal))
+        self.session.delete_list(self.ref_entity, ['ref55', 'ref57'])
+
+    def test_add_all_with_files(self):
+        self._try_delete(self.ref_entity, ['ref55', 'ref57'])
+        response = self.session.add_all_with_files(self.ref_entity,
+                                                   [{"value": "ref55", "label": "label55"},
+                                                    {"value": "ref57", "label": "label57"}])
+        self.assertEqual(['ref55', 'ref57'], response)
+        self.assertEqual(2, len(self.session.get(self.ref_entity, q="value=in=(ref55,ref57)")))
+        self.session.delete_list(self.ref_entity, ['ref55', 'ref57'])
+
+    def test_download_files_without_file_attributes(self):
+        self.assertEqual({}, self.session.download_files(self.ref_entity, './tests/downloads'))
+
+    def test_load(self):
+        self._try_delete(self.ref_entity, ['ref55', 'ref57'])
+        response = self.session.load({self.ref_entity: [{"value": "ref55", "label": "label55"},
+                                                        {"value": "ref57", "label": "label57"}]})
+        self.assertEqual({self.ref_entity: ['ref55', 'ref57']}, response)
+        self.session.delete_list(self.ref_entity, ['ref55', 'ref57'])
+
+    def test_writer(self):
+        self._try_delete(self.ref_entity, ['ref55', 'ref57'])
+        with self.session.writer(self.ref_entity, batch_size=1) as writer:
+            writer.write({"value": "ref55", "label": "label55"})
+            writer.write({"value": "ref57", "label": "label57"})
+        self.assertEqual(2, writer.written)
+        self.assertEqual(2, len(self.session.get(self.ref_entity, q="value=in=(ref55,ref57)")))
+        self.session.delete_list(self.ref_entity, ['ref55', 'ref57'])
+
     def test_add_all_error(self):
         try:
             self.session.add_all(self.ref_entity, [{"value": "ref55"}])
@@ -236,6 +311,13 @@ class TestStringMethods(unittest.TestCase):
         no_items = self.session.get(self.ref_entity, q='value=in=(ref55,ref57)')
         self.assertEqual(len(no_items), 0, 'Check if items that were deleted are really deleted')
 
+    def test_delete_where(self):
+        self._try_add(self.ref_entity, [{"value": "ref55", "label": "label55"},
+                                        {"value": "ref57", "label": "label57"}])
+        self.assertEqual(2, self.session.delete_where(self.ref_entity, 'value=in=(ref55,ref57)'))
+        self.assertEqual(5, len(self.session.get(self.ref_entity)))
+        self.assertEqual(0, self.session.delete_where(self.ref_entity, 'value==ref55'))
+
     def test_add_dict(self):
         self._try_delete(self.ref_entity, ['ref55'])
         self.assertEqual('ref55', self.session.add(self.ref_entity, {"value": "ref55", "label": "label55"}))
@@ -252,6 +334,16 @@ class TestStringMethods(unittest.TestCase):
         self.assertEqual("updated-label55", item55["label"])
         self.session.delete(self.ref_entity, 'ref55')
 
+    def test_update_attributes(self):
+        self._try_delete(self.ref_entity, ['ref55', 'ref57'])
+        self.session.add_all(self.ref_entity, [{"value": "ref55", "label": "label55"},
+                                               {"value": "ref57", "label": "label57"}])
+        self.assertEqual(2, self.session.update_attributes(self.ref_entity, {'ref55': {'label': 'updated-label55'},
+                                                                             'ref57': {'label': 'updated-label57'}}))
+        items = self.session.get(self.ref_entity, q='value=in=(ref55,ref57)', attributes='label', sort_column='value')
+        self.assertEqual(['updated-label55', 'updated-label57'], [item['label'] for item in items])
+        self.session.delete_list(self.ref_entity, ['ref55', 'ref57'])
+
     def test_update_one_error(self):
         try:
             self.session.update_one(self.ref_entity, 'ref555', 'label', 'updated-label555')
@@ -324,6 +416,33 @@ class TestStringMethods(unittest.TestCase):
         self.assertEqual("test_new_token", new[0]["token"])
         self.session.delete_list(entity, [updated["id"], new[0]["id"]])
 
+    def test_upsert_diff(self):
+        self._try_delete(self.ref_entity, ['ref55', 'ref66'])
+        self.session.add_all(self.ref_entity, [{"value": "ref55", "label": "label55"},
+                                               {"value": "ref66", "label": "label66"}])
+        counts = self.session.upsert(self.ref_entity, [{"value": "ref55", "label": "label55"},
+                                                       {"value": "ref66", "label": "updated-label66"},
+                                                       {"value": "ref77", "label": "label77"}], diff=True)
+        self.assertEqual({"added": 1, "updated": 1, "unchanged": 1}, counts)
+        item66 = self.session.get_by_id(self.ref_entity, "ref66", "label")
+        self.assertEqual("updated-label66", item66["label"])
+        self.session.delete_list(self.ref_entity, ['ref55', 'ref66', 'ref77'])
+
+    def test_row_hash(self):
+        self.assertEqual(utils.row_hash({"a": 1998, "b": True, "c": None}),
+                         utils.row_hash({"a": "1998", "b": "true"}, ["a", "b", "c"]))
+        self.assertNotEqual(utils.row_hash({"a": ["x", "y"]}), utils.row_hash({"a": ["y", "x"]}))
+
+    def test_row_hash_types(self):
+        types = {"n": "decimal", "d": "date", "t": "date_time"}
+        utc = datetime.timezone.utc
+        self.assertEqual(utils.row_hash({"n": 1.5, "d": "1985-02-03", "t": "2020-01-02T03:04:05Z"}, types=types),
+                         utils.row_hash({"n": Decimal("1.50"), "d": datetime.date(1985, 2, 3),
+                                         "t": datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=utc)}, types=types))
+        self.assertEqual(utils.row_hash({"t": "2020-01-02T05:04:05+02:00"}, types=types),
+                         utils.row_hash({"t": "2020-01-02T03:04:05Z"}, types=types))
+        self.assertNotEqual(utils.row_hash({"n": "1.5"}, types=types), utils.row_hash({"n": "1.6"}, types=types))
+
     def test_add_kwargs(self):
         self._try_delete(self.ref_entity, ['ref55'])
         self.assertEqual('ref55', self.session.add(self.ref_entity, value="ref55", label="label55"))
@@ -377,12 +496,87 @@ class TestStringMethods(unittest.TestCase):
         self.assertEqual(len(first_item), 3)
         self.assertEqual(expected, first_item['xcomputedxref'])
 
+    def test_get_resolve_refs(self):
+        expected = self.session.get(self.entity, expand='xcomputedxref,xmref_value')
+        data = self.session.get(self.entity, expand='xcomputedxref,xmref_value', resolve_refs=True)
+        self.assertEqual(expected, data)
+
+    def test_get_resolve_refs_attrs(self):
+        data = self.session.get(self.entity, expand='xcomputedxref', attributes='id', resolve_refs=True)
+        first_item = data[0]
+        expected = {"_href": "/api/v2/org_molgenis_test_python_Location/5", "Chromosome": "str1", "Position": 5}
+        self.assertEqual(len(first_item), 3)
+        self.assertEqual(expected, first_item['xcomputedxref'])
+
+    def test_get_compact(self):
+        data = self.session.get(self.ref_entity, compact=True)
+        expected = [{'value': row['value'], 'label': row['label']} for row in self.expected_ref_data]
+        self.assertEqual(expected, data.to_dicts())
+
+    @unittest.skipIf(importlib.util.find_spec('pandas') is None, 'pandas is not installed')
+    def test_get_frame(self):
+        frame = self.session.get_frame(self.ref_entity)
+        self.assertEqual(['ref1', 'ref2', 'ref3', 'ref4', 'ref5'], list(frame['value']))
+        self.assertEqual(['value', 'label'], list(frame.columns))
+
+    def test_get_progress(self):
+        reports = []
+        data = self.session.get(self.ref_entity, batch_size=2, progress=reports.append)
+        self.assertEqual(len(data), reports[-1].done)
+        self.assertEqual(len(data), reports[-1].total)
+
+    def test_get_local_table(self):
+        table = self.session.get_local_table(self.ref_entity, indexes=['label'])
+        self.assertEqual(self.session.get(self.ref_entity, q='label=in=(label1,label3)', uploadable=True),
+                         table.get('label=in=(label1,label3)'))
+
+    def test_get_typed(self):
+        row = self.session.get(self.entity, q='id==1', typed=True)[0]
+        self.assertIsInstance(row['xdate'], datetime.date)
+        self.assertIsInstance(row['xdatetime'], datetime.datetime)
+        self.assertIsInstance(row['xdecimal'], Decimal)
+        self.assertEqual(row['xdate'], self.session.get_by_id(self.entity, '1', typed=True)['xdate'])
+
+    def test_prefetch_meta(self):
+        session = molgenis.Session(self.api_url, token=self.session._token)
+        self.assertIn(self.entity, session.prefetch_meta('org_molgenis_test_python'))
+        expected = self.session.get_meta(self.entity, abstract=True)['attributes']['items']
+        actual = session._get_cached_meta(self.entity)['attributes']['items']
+        self.assertEqual([(attr['data']['name'], attr['data']['type'], attr['data'].get('idAttribute', False),
+                           utils.get_ref_entity_type_id(attr['data'])) for attr in expected],
+                         [(attr['data']['name'], attr['data']['type'], attr['data']['idAttribute'],
+                           utils.get_ref_entity_type_id(attr['data'])) for attr in actual])
+
+    def test_get_many(self):
+        data = self.session.get_many({self.ref_entity: None, self.entity: {'q': 'id==1', 'attributes': 'id'}})
+        self.assertEqual(self.expected_ref_data, data[self.ref_entity])
+        self.assertEqual(1, len(data[self.entity]))
+        self.assertEqual('/api/v2/org_molgenis_test_python_TypeTest/1', data[self.entity][0]['_href'])
+
+    def test_get_many_stream(self):
+        data = dict(self.session.get_many({self.ref_entity: None, self.entity: {'num': 2}}, stream=True))
+        self.assertEqual(self.expected_ref_data, data[self.ref_entity])
+        self.assertEqual(2, len(data[self.entity]))
+
     def test_get_uploadable(self):
         data = self.session.get(self.entity, uploadable=True)
         first_item = data[0]['xcategorical_value']
         expected = 'ref1'
         self.assertEqual(expected, first_item)
 
+    def test_count(self):
+        self.assertEqual(5, self.session.count(self.ref_entity))
+        self.assertEqual(2, self.session.count(self.ref_entity, q='value=in=(ref1,ref2)'))
+
+    def test_aggregate(self):
+        counts = self.session.aggregate(self.ref_entity, x='label', q='value=in=(ref1,ref2)')
+        self.assertEqual({'label1': 1, 'label2': 1}, counts)
+
+    def test_build_api_url_num_zero(self):
+        base_url = 'https://test.frl/api/test'
+        generated_url = query_utils.build_api_url(base_url, {'q': None, 'num': 0, 'start': 0})
+        self.assertEqual(base_url + '?num=0', generated_url)
+
     def test_get_entity_meta(self):
         meta = self.session.get_entity_meta_data(self.user_entity)
         self.assertEqual('username', meta['labelAttribute'])
@@ -493,6 +687,22 @@ class TestStringMethods(unittest.TestCase):
         self.assertEqual(expected_sort, observed_sort)
         self.assertEqual(sorted(expected_attrs), sorted(observed_attrs))
 
+    def test_build_api_url_projections(self):
+        base_url = 'https://test.frl/api/test'
+        possible_options = {'attrs': [None, None, {'x': 'id', 'y': 'value'}]}
+        generated_url = query_utils.build_api_url(base_url, possible_options)
+        expected_attrs = ['*', 'x(id)', 'y(value)']
+        observed_attrs = generated_url.split('?')[1].replace('attrs=', '').split(',')
+        self.assertEqual(sorted(expected_attrs), sorted(observed_attrs))
+
+    def test_build_api_url_projections_attrs(self):
+        base_url = 'https://test.frl/api/test'
+        possible_options = {'attrs': ['x,z', 'z', {'x': 'id', 'y': 'value'}]}
+        generated_url = query_utils.build_api_url(base_url, possible_options)
+        expected_attrs = ['x(id)', 'z(*)']
+        observed_attrs = generated_url.split('?')[1].replace('attrs=', '').split(',')
+        self.assertEqual(sorted(expected_attrs), sorted(observed_attrs))
+
     def test_build_api_url_error(self):
         base_url = 'https://test.frl/api/test'
         possible_options = {'q': [{"field": "x", "operator": "EQUALS", "value": "1"}],
@@ -0,0 +1,111 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from molgenis.concurrency import AdaptiveLimiter, RateLimiter, SingleFlight, backoff_delay
+
+
+class TestConcurrency(unittest.TestCase):
+
+    def test_limiter_increases_on_success(self):
+        limiter = AdaptiveLimiter(maximum=4, initial=2)
+        for _ in range(10):
+            limiter.acquire()
+            limiter.release(0.01)
+        self.assertEqual(4, limiter.limit)
+
+    def test_limiter_halves_when_overloaded(self):
+        limiter = AdaptiveLimiter(maximum=8, initial=8)
+        limiter.acquire()
+        limiter.release(0.01, overloaded=True)
+        self.assertEqual(4, limiter.limit)
+
+    def test_limiter_decreases_once_per_round_trip(self):
+        limiter = AdaptiveLimiter(maximum=8, initial=8)
+        for _ in range(3):
+            limiter.acquire()
+        for _ in range(3):
+            limiter.release(10, overloaded=True)
+        self.assertEqual(4, limiter.limit)
+
+    def test_limiter_respects_minimum(self):
+        limiter = AdaptiveLimiter(maximum=2, minimum=1, initial=1)
+        limiter.acquire()
+        limiter.release(0.01, overloaded=True)
+        self.assertEqual(1, limiter.limit)
+
+    def test_limiter_statistics(self):
+        limiter = AdaptiveLimiter()
+        for latency in (0.1, 0.3):
+            limiter.acquire()
+            limiter.release(latency)
+        statistics = limiter.statistics()
+        self.assertEqual(2, statistics["requests"])
+        self.assertAlmostEqual(0.2, statistics["mean_latency"])
+        self.assertEqual(0.3, statistics["max_latency"])
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(100)
+        start = time.monotonic()
+        for _ in range(150):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.4)
+
+    def test_backoff_delay(self):
+        self.assertEqual(0.5, backoff_delay(0))
+        self.assertEqual(2.0, backoff_delay(2))
+        self.assertEqual(7.0, backoff_delay(0, '7'))
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.calls = 0
+        self.release = threading.Event()
+
+    def slow(self, result='result'):
+        self.calls += 1
+        self.release.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def run_concurrently(self, key, func, count=5):
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            futures = [executor.submit(self.flight.do, key, func) for _ in range(count)]
+            time.sleep(0.1)
+            self.release.set()
+        return futures
+
+    def test_concurrent_calls_share_one_execution(self):
+        futures = self.run_concurrently('key', self.slow)
+        self.assertEqual(['result'] * 5, [future.result() for future in futures])
+        self.assertEqual(1, self.calls)
+
+    def test_exception_is_shared(self):
+        futures = self.run_concurrently('key', lambda: self.slow(ValueError('failed')))
+        self.assertEqual([ValueError] * 5, [type(future.exception()) for future in futures])
+        self.assertEqual(1, self.calls)
+
+    def test_later_calls_execute_again(self):
+        self.release.set()
+        self.flight.do('key', self.slow)
+        self.flight.do('key', self.slow)
+        self.assertEqual(2, self.calls)
+
+    def test_forget(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(self.flight.do, 'key', self.slow)
+            time.sleep(0.1)
+            self.flight.forget()
+            second = executor.submit(self.flight.do, 'key', self.slow)
+            time.sleep(0.1)
+            self.release.set()
+        self.assertEqual(['result', 'result'], [first.result(), second.result()])
+        self.assertEqual(2, self.calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
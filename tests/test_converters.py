@@ -0,0 +1,42 @@
+import datetime
+import json
+import unittest
+from decimal import Decimal
+
+from molgenis.converters import convert_rows, get_converters, json_default
+
+
+def _meta(**types):
+    return {'attributes': {'items': [{'data': {'name': name, 'type': type_}} for name, type_ in types.items()]}}
+
+
+class TestConverters(unittest.TestCase):
+    meta = _meta(id='string', born='date', seen='date_time', height='decimal', age='int')
+
+    def test_get_converters(self):
+        self.assertEqual({'born', 'seen', 'height'}, set(get_converters(self.meta)))
+        self.assertEqual({'born'}, set(get_converters(self.meta, ['id', 'born'])))
+
+    def test_convert_rows(self):
+        rows = [{'id': '1', 'born': '1985-02-03', 'seen': '2020-01-02T03:04:05Z', 'height': 1.8, 'age': 35},
+                {'id': '2', 'born': None, 'seen': '2020-01-02T03:04:05.123+02:00'}]
+        convert_rows(rows, get_converters(self.meta))
+        utc = datetime.timezone.utc
+        self.assertEqual({'id': '1', 'born': datetime.date(1985, 2, 3),
+                          'seen': datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=utc), 'height': Decimal('1.8'),
+                          'age': 35}, rows[0])
+        self.assertIsNone(rows[1]['born'])
+        self.assertEqual(datetime.datetime(2020, 1, 2, 1, 4, 5, 123000, tzinfo=utc), rows[1]['seen'])
+
+    def test_round_trip(self):
+        row = {'id': '1', 'born': '1985-02-03', 'seen': '2020-01-02T03:04:05Z', 'height': 1.8}
+        typed = convert_rows([dict(row)], get_converters(self.meta))[0]
+        self.assertEqual(row, json.loads(json.dumps(typed, default=json_default)))
+
+    def test_json_default_unknown_type(self):
+        with self.assertRaises(TypeError):
+            json.dumps({'value': object()}, default=json_default)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+from molgenis.frames import FrameBuilder
+
+
+@unittest.skipIf(pandas is None, 'pandas is not installed')
+class TestFrameBuilder(unittest.TestCase):
+
+    def test_build(self):
+        builder = FrameBuilder(['id', 'age', 'born', 'city', 'friends'],
+                               {'id': 'string', 'age': 'int', 'born': 'date', 'city': 'xref', 'friends': 'mref'},
+                               {'city': 'name', 'friends': 'id'})
+        builder.add_page([{'id': '1', 'age': 30, 'born': '1990-01-01', 'city': {'name': 'Groningen'},
+                           'friends': [{'id': '2'}]}])
+        builder.add_page([{'id': '2', 'friends': []}])
+        frame = builder.build()
+
+        self.assertEqual(['1', '2'], list(frame['id']))
+        self.assertEqual('Int32', str(frame['age'].dtype))
+        self.assertTrue(pandas.isna(frame['age'][1]))
+        self.assertEqual(pandas.Timestamp('1990-01-01'), frame['born'][0])
+        self.assertEqual(['Groningen', None], list(frame['city']))
+        self.assertEqual([['2'], []], list(frame['friends']))
+
+    def test_categories(self):
+        builder = FrameBuilder(['gender'], {'gender': 'enum'}, {})
+        builder.add_page([{'gender': 'female'}])
+        builder.add_page([{'gender': 'male'}, {'gender': 'female'}])
+        frame = builder.build()
+        self.assertEqual('category', str(frame['gender'].dtype))
+        self.assertEqual(['female', 'male'], list(frame['gender'].cat.categories))
+
+    def test_empty(self):
+        frame = FrameBuilder(['id', 'age'], {'age': 'long'}, {}).build()
+        self.assertEqual(['id', 'age'], list(frame.columns))
+        self.assertEqual(0, len(frame))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+
+from molgenis.journal import Journal, content_hash, open_journal
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'add.journal')
+        self.rows = [{'id': '1'}, {'id': '2'}]
+
+    def test_record_is_read_by_rerun(self):
+        Journal(self.path).record('add_all', 'Person', 0, content_hash(self.rows), ['1', '2'], 0, 2)
+        entry = Journal(self.path).get('add_all', 'Person', 0, content_hash(self.rows))
+        self.assertEqual(['1', '2'], entry['result'])
+        self.assertEqual((0, 2), (entry['start'], entry['end']))
+
+    def test_changed_content_is_not_committed(self):
+        journal = Journal(self.path)
+        journal.record('add_all', 'Person', 0, content_hash(self.rows), ['1', '2'])
+        self.assertIsNone(journal.get('add_all', 'Person', 0, content_hash([{'id': '3'}])))
+        self.assertIsNone(journal.get('add_all', 'Person', 1, content_hash(self.rows)))
+
+    def test_incomplete_line_is_ignored(self):
+        Journal(self.path).record('add_all', 'Person', 0, content_hash(self.rows), ['1', '2'])
+        with open(self.path, 'a') as file:
+            file.write('{"operation": "add_all", "enti')
+        self.assertIsNotNone(Journal(self.path).get('add_all', 'Person', 0, content_hash(self.rows)))
+
+    def test_content_hash_is_stable(self):
+        self.assertEqual(content_hash([{'a': 1, 'b': 2}]), content_hash([{'b': 2, 'a': 1}]))
+
+    def test_open_journal(self):
+        journal = Journal(self.path)
+        self.assertIs(journal, open_journal(journal))
+        self.assertEqual(self.path, str(open_journal(self.path).path))
+        self.assertIsNone(open_journal(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+
+from molgenis.mirror import SQLiteMirror
+
+
+class SessionStub:
+    """Serves the rows of a single entity type, supporting the queries used by the mirror."""
+
+    meta = {"id": "Person", "attributes": {"items": [
+        {"data": {"name": "id", "type": "string", "idAttribute": True}},
+        {"data": {"name": "friends", "type": "mref", "idAttribute": False}},
+        {"data": {"name": "adult", "type": "bool", "idAttribute": False}},
+        {"data": {"name": "updatedAt", "type": "date_time", "idAttribute": False}},
+    ]}}
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def get_meta(self, entity_type_id, abstract=False):
+        return self.meta
+
+    def count(self, entity, q=None):
+        return len(self.rows)
+
+    def get(self, entity, q=None, attributes=None, batch_size=100, uploadable=False):
+        self.queries.append(q)
+        rows = self.rows
+        if q:
+            timestamp = q.split("=ge=")[1].replace("%3A", ":")
+            rows = [row for row in rows if row["updatedAt"] >= timestamp]
+        if attributes:
+            rows = [{attributes: row[attributes]} for row in rows]
+        return [dict(row) for row in rows]
+
+
+class TestSQLiteMirror(unittest.TestCase):
+
+    def setUp(self):
+        self.session = SessionStub([
+            {"id": "1", "friends": ["2"], "adult": True, "updatedAt": "2020-01-01T00:00:00Z"},
+            {"id": "2", "friends": [], "adult": False, "updatedAt": "2020-01-02T00:00:00Z"},
+        ])
+        self.mirror = SQLiteMirror(self.session, ":memory:")
+
+    def tearDown(self):
+        self.mirror.close()
+
+    def test_sync_initial(self):
+        self.assertEqual({"changed": 2, "deleted": 0}, self.mirror.sync("Person"))
+        self.assertEqual([None], self.session.queries)
+        self.assertEqual(self.session.rows, self.mirror.get("Person", order_by='"id"'))
+
+    def test_sync_changes(self):
+        self.mirror.sync("Person")
+        self.session.rows[0] = {"id": "1", "friends": [], "adult": False, "updatedAt": "2020-01-03T00:00:00Z"}
+        # Rows with the latest timestamp seen are retrieved again, they may have changed within the same instant
+        self.assertEqual({"changed": 2, "deleted": 0}, self.mirror.sync("Person"))
+        self.assertEqual("updatedAt=ge=2020-01-02T00%3A00%3A00Z", self.session.queries[1])
+        self.assertEqual(self.session.rows[0], self.mirror.get_by_id("Person", "1"))
+
+    def test_sync_deletes(self):
+        self.mirror.sync("Person")
+        del self.session.rows[0]
+        self.assertEqual({"changed": 1, "deleted": 1}, self.mirror.sync_all()["Person"])
+        self.assertIsNone(self.mirror.get_by_id("Person", "1"))
+
+    def test_get_where(self):
+        self.mirror.sync("Person")
+        self.mirror.create_index("Person", "adult")
+        self.assertEqual([self.session.rows[1]], self.mirror.get("Person", where='"adult" = ?', parameters=(False,)))
+
+    def test_sync_empty_table_twice(self):
+        self.session.rows = []
+        self.assertEqual({"changed": 0, "deleted": 0}, self.mirror.sync("Person"))
+        self.assertEqual({"changed": 0, "deleted": 0}, self.mirror.sync("Person"))
+        self.assertEqual([None, None], self.session.queries)
+
+    def test_failed_first_sync_leaves_nothing_behind(self):
+        self.session.count = None  # Makes the sync fail after the rows were retrieved
+        with self.assertRaises(TypeError):
+            self.mirror.sync("Person")
+        self.assertEqual([], self.mirror.entities)
+        del self.session.count
+        self.assertEqual({"changed": 2, "deleted": 0}, self.mirror.sync("Person"))
+
+    def test_sync_unknown_timestamp_attribute(self):
+        with self.assertRaises(ValueError):
+            self.mirror.sync("Person", timestamp_attribute="modified")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from molgenis.api_support import Progress, ProgressTracker
+
+
+class TestProgressTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.reports = []
+
+    def test_reports_progress(self):
+        tracker = ProgressTracker(self.reports.append, 'add_all', 'Person', total=3, min_interval=0)
+        tracker.advance(1)
+        tracker.advance(2)
+        self.assertEqual([(1, 3), (3, 3)], [(progress.done, progress.total) for progress in self.reports])
+        self.assertEqual('add_all', self.reports[0].operation)
+
+    def test_throttles_but_reports_final_progress(self):
+        tracker = ProgressTracker(self.reports.append, 'get', 'Person', total=100, min_interval=60)
+        for _ in range(100):
+            tracker.advance(1)
+        self.assertEqual([1, 100], [progress.done for progress in self.reports])
+
+    def test_finish_reports_unknown_total_once(self):
+        tracker = ProgressTracker(self.reports.append, 'get', 'Person', min_interval=60)
+        tracker.advance(1)
+        tracker.advance(1)
+        tracker.finish()
+        tracker.finish()
+        self.assertEqual([1, 2], [progress.done for progress in self.reports])
+
+    def test_no_tracker_without_callback(self):
+        self.assertIsNone(ProgressTracker.of(None, 'get', 'Person'))
+
+    def test_rate(self):
+        self.assertEqual(50.0, Progress('get', 'Person', 100, None, 2.0).rate)
+        self.assertEqual(0.0, Progress('get', 'Person', 0, None, 0.0).rate)
+
+
+if __name__ == '__main__':
+    unittest.main()
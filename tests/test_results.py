@@ -0,0 +1,81 @@
+import os
+import unittest
+
+from molgenis.results import CompactRows, SpilledRows
+
+
+class TestCompactRows(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = CompactRows(['id', 'name'])
+        self.rows.extend([{'_href': '/api/v2/Person/1', 'id': '1', 'name': 'Jan'},
+                          {'_href': '/api/v2/Person/2', '_meta': {}, 'id': '2'}])
+
+    def test_row_view(self):
+        self.assertEqual({'id': '1', 'name': 'Jan'}, dict(self.rows[0]))
+        self.assertEqual('Jan', self.rows[0]['name'])
+        self.assertEqual(2, len(self.rows[0]))
+
+    def test_missing_value(self):
+        self.assertEqual({'id': '2'}, dict(self.rows[1]))
+        self.assertNotIn('name', self.rows[1])
+        self.assertIsNone(self.rows[1].get('name'))
+        with self.assertRaises(KeyError):
+            self.rows[1]['name']
+
+    def test_unknown_attribute_extends_schema(self):
+        self.rows.extend([{'id': '3', 'age': 30}])
+        self.assertEqual(['id', 'name', 'age'], self.rows.attributes)
+        self.assertEqual({'id': '3', 'age': 30}, dict(self.rows[2]))
+        self.assertEqual({'id': '1', 'name': 'Jan'}, dict(self.rows[0]))
+
+    def test_sequence(self):
+        self.assertEqual(2, len(self.rows))
+        self.assertEqual(['1', '2'], [row['id'] for row in self.rows])
+        self.assertEqual([{'id': '2'}], self.rows[1:].to_dicts())
+        self.assertEqual({'id': '2'}, dict(self.rows[-1]))
+
+
+class TestSpilledRows(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = SpilledRows(page_size=10, cache_pages=2)
+        self.rows.extend({'id': str(i), 'value': i} for i in range(95))
+
+    def tearDown(self):
+        self.rows.close()
+
+    def test_sequence(self):
+        self.assertEqual(95, len(self.rows))
+        self.assertEqual({'id': '42', 'value': 42}, self.rows[42])
+        self.assertEqual('94', self.rows[-1]['id'])
+        self.assertEqual(list(range(95)), [row['value'] for row in self.rows])
+        self.assertEqual([8, 11, 14], [row['value'] for row in self.rows[8:15:3]])
+        with self.assertRaises(IndexError):
+            self.rows[95]
+
+    def test_cache_is_bounded(self):
+        for row in self.rows:
+            pass
+        self.assertEqual(2, len(self.rows._cache))
+
+    def test_rows_are_copies(self):
+        self.rows[3]['value'] = 'changed'
+        self.assertEqual(3, self.rows[3]['value'])
+
+    def test_extend_after_access(self):
+        self.assertEqual(90, self.rows[90]['value'])
+        self.rows.extend([{'id': '95', 'value': 95}] * 10)
+        self.assertEqual(105, len(self.rows))
+        self.assertEqual([90, 95], [self.rows[90]['value'], self.rows[104]['value']])
+
+    def test_close_removes_file(self):
+        path = self.rows._path
+        self.assertTrue(os.path.exists(path))
+        self.rows.close()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(0, len(self.rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+from molgenis.rsql import And, Comparison, LocalTable, Or, parse
+
+
+class TestParse(unittest.TestCase):
+
+    def test_comparison(self):
+        self.assertEqual(Comparison('age', '=gt=', ('18',)), parse('age=gt=18'))
+        self.assertEqual(Comparison('age', '=le=', ('18',)), parse('age<=18'))
+
+    def test_arguments(self):
+        self.assertEqual(Comparison('name', '=in=', ('Jan', 'Piet Jan', "d'Arc")),
+                         parse('name=in=(Jan,"Piet Jan",\'d\\\'Arc\')'))
+        self.assertEqual(Comparison('mother', '==', ('',)), parse('mother==""'))
+
+    def test_precedence(self):
+        a, b, c = (Comparison(name, '==', ('1',)) for name in 'abc')
+        self.assertEqual(Or((a, And((b, c)))), parse('a==1,b==1;c==1'))
+        self.assertEqual(And((Or((a, b)), c)), parse('(a==1 or b==1) and c==1'))
+
+    def test_invalid(self):
+        for q in ['age', 'age=foo=1', 'a==1;', '(a==1', 'a==1)']:
+            with self.assertRaises(ValueError, msg=q):
+                parse(q)
+
+
+class TestLocalTable(unittest.TestCase):
+
+    def setUp(self):
+        rows = [{'id': '1', 'name': 'Jan', 'age': 30, 'adult': True, 'friends': ['2', '3'], 'date': '2020-01-01'},
+                {'id': '2', 'name': 'Piet', 'age': 12, 'adult': False, 'friends': ['1'], 'date': '2020-06-01'},
+                {'id': '3', 'name': 'Klaas', 'age': 45, 'adult': True, 'friends': [], 'date': '2021-01-01'},
+                {'id': '4', 'name': 'Jannie', 'adult': True}]
+        types = {'id': 'string', 'name': 'string', 'age': 'int', 'adult': 'bool', 'friends': 'mref', 'date': 'date'}
+        self.table = LocalTable(rows, types)
+        self.indexed = LocalTable(rows, types, indexes=['name', 'age', 'friends', 'date'])
+
+    def ids(self, q):
+        ids = [row['id'] for row in self.table.get(q)]
+        self.assertEqual(ids, [row['id'] for row in self.indexed.get(q)], q)
+        return ids
+
+    def test_equality(self):
+        self.assertEqual(['1'], self.ids('name==Jan'))
+        self.assertEqual(['2', '3', '4'], self.ids('name!=Jan'))
+        self.assertEqual(['1', '3'], self.ids('age=in=(30,45.0)'))
+        self.assertEqual(['2'], self.ids('age=out=(30,45);age!=""'))
+        self.assertEqual(['4'], self.ids('age==""'))
+        self.assertEqual(['2'], self.ids('adult==false'))
+
+    def test_mref(self):
+        self.assertEqual(['1', '2'], self.ids('friends=in=(1,3)'))
+        self.assertEqual(['3', '4'], self.ids('friends==""'))
+
+    def test_ranges(self):
+        self.assertEqual(['2'], self.ids('age=lt=30'))
+        self.assertEqual(['1', '2'], self.ids('age<=30'))
+        self.assertEqual(['3'], self.ids('age=gt=30'))
+        self.assertEqual(['1', '3'], self.ids('age=rng=(30,45)'))
+        self.assertEqual(['2', '3'], self.ids('date=ge=2020-06-01'))
+
+    def test_like(self):
+        self.assertEqual(['1', '4'], self.ids('name=like=jan'))
+        self.assertEqual(['2', '3'], self.ids('name=notlike=jan'))
+
+    def test_groups(self):
+        self.assertEqual(['1', '3'], self.ids('(name==Jan or name==Klaas);age=gt=20'))
+        self.assertEqual(['2', '3'], self.ids('age=lt=20,name=like=klaas'))
+
+    def test_no_query(self):
+        self.assertEqual(4, len(self.table.get()))
+        self.assertEqual(4, len(self.table))
+
+    def test_derived_types(self):
+        table = LocalTable([{'id': 'a', 'size': 2}, {'id': 'b', 'size': 10}], indexes=['size'])
+        self.assertEqual([{'id': 'b', 'size': 10}], table.get('size=gt=9'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+from molgenis.writer import Writer
+
+
+class SessionStub:
+    """Records the batches that are written."""
+
+    def __init__(self, delay=0.0, fail=False):
+        self.batches = []
+        self.delay = delay
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def add_all(self, entity, entities):
+        time.sleep(self.delay)
+        if self.fail:
+            raise ValueError("400 Client Error")
+        with self.lock:
+            self.batches.append(list(entities))
+
+    update_all = add_all
+    _upsert_batch = add_all
+
+
+class TestWriter(unittest.TestCase):
+
+    def test_writes_full_batches(self):
+        session = SessionStub()
+        with Writer(session, 'Person', batch_size=2, flush_interval=None) as writer:
+            for i in range(5):
+                writer.write({'id': str(i)})
+        self.assertEqual([2, 2, 1], sorted((len(batch) for batch in session.batches), reverse=True))
+        self.assertEqual(5, writer.written)
+
+    def test_flush_interval(self):
+        session = SessionStub()
+        with Writer(session, 'Person', batch_size=100, flush_interval=0.1) as writer:
+            writer.write({'id': '1'})
+            time.sleep(0.3)
+            self.assertEqual([[{'id': '1'}]], session.batches)
+
+    def test_keeps_order_when_updating(self):
+        session = SessionStub(delay=0.01)
+        with Writer(session, 'Person', mode='update', batch_size=1, flush_interval=None) as writer:
+            writer.write_all({'id': '1', 'name': str(i)} for i in range(10))
+        self.assertEqual([str(i) for i in range(10)], [batch[0]['name'] for batch in session.batches])
+
+    def test_raises_error_on_flush(self):
+        writer = Writer(SessionStub(fail=True), 'Person', batch_size=1, flush_interval=None)
+        writer.write({'id': '1'})
+        with self.assertRaises(ValueError):
+            writer.flush()
+        writer.close()
+
+    def test_raises_error_of_batch_in_flight(self):
+        # Delay the done callbacks, which run after the waiters for a future have been woken up
+        invoke_callbacks = Future._invoke_callbacks
+
+        def invoke_callbacks_later(future):
+            time.sleep(0.1)
+            invoke_callbacks(future)
+
+        with mock.patch.object(Future, '_invoke_callbacks', invoke_callbacks_later):
+            writer = Writer(SessionStub(fail=True), 'Person', batch_size=1, flush_interval=None)
+            writer.write({'id': '1'})
+            with self.assertRaises(ValueError):
+                writer.flush()
+            writer.close()
+
+    def test_backpressure(self):
+        session = SessionStub(delay=0.1)
+        writer = Writer(session, 'Person', batch_size=1, flush_interval=None, max_pending=1)
+        start = time.monotonic()
+        for i in range(3):
+            writer.write({'id': str(i)})
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        writer.close()
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            Writer(SessionStub(), 'Person', mode='replace')
+
+
+if __name__ == '__main__':
+    unittest.main()